@@ -0,0 +1,427 @@
+"""
+benchmark suite for the world model pipeline
+
+measures, over the annotated world models in output_files/data:
+	load: json_to_MWP throughput
+	linearize: compute_diff / to_sequence throughput
+	replay: rebuilding every world model from its gold linearizations with update_world_model
+	reason: per problem reasoning latency (percentiles) and the number of problems reasoned to the annotated answer
+	metrics: strongly_equal, weakly_equal and smatch
+and, on synthetic problems of growing size (long transfer chains and wide part-wholes), the time to build and
+reason over them, for scaling curves
+
+every phase is run --repeat times, each time with an empty sympy cache, and the fastest time of every item is kept
+the baseline also stores a calibration time of a fixed workload, so that timings measured on another machine can
+be compared after scaling the baseline by the ratio of the calibration times; timings vary by 20% or more between
+runs on a busy machine, so they are only compared with --timings
+
+usage (from the repository root):
+	python -m benchmarks.benchmark                       # run and compare the counts against benchmarks/baseline.json
+	python -m benchmarks.benchmark --timings             # also compare mean and median timings, calibrated
+	python -m benchmarks.benchmark --save-baseline       # run and overwrite the baseline
+	python -m benchmarks.benchmark --limit 100 --sizes 4 16 64
+
+results are written with sorted keys and rounded numbers so that a changed baseline shows up as a readable diff
+"""
+import argparse
+import contextlib
+import gc
+import glob
+import io
+import json
+import os
+import time
+
+import numpy as np
+from sympy.core.cache import clear_cache
+
+from worldmodel import profiling
+from worldmodel.loader import json_to_MWP, update_world_model
+from worldmodel.metrics import strongly_equal, weakly_equal, smatch, corpus_smatch
+from worldmodel.mwp import MWP
+from worldmodel.reasoner import DeterministicReasoner
+from worldmodel.generator import WorldModelGenerator, _letters
+
+DATA_PATTERN = os.path.join("output_files", "data", "*", "*", "*.json")
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+PERCENTILES = [50, 90, 99]
+
+# relative slowdown of a calibrated timing against the baseline that is reported as a regression (with --timings)
+TOLERANCE = 0.25
+
+
+def annotation_paths(pattern=DATA_PATTERN, limit=None):
+	paths = sorted(glob.glob(pattern))
+	return paths[:limit] if limit else paths
+
+
+def _timing(durations):
+	"""
+	summary of a list of durations in seconds
+	"""
+	durations = np.array(durations, dtype=float)
+	out = {"n": len(durations), "total": float(durations.sum())}
+	if len(durations):
+		out["mean"] = float(durations.mean())
+		for p in PERCENTILES:
+			out[f"p{p}"] = float(np.percentile(durations, p))
+		out["per_second"] = len(durations) / out["total"] if out["total"] > 0 else 0.0
+	return out
+
+
+def _time_each(items, f):
+	"""
+	call f on every item and return the results and the duration of every call
+	"""
+	results, durations = [], []
+	for item in items:
+		start = time.perf_counter()
+		results.append(f(item))
+		durations.append(time.perf_counter() - start)
+	return results, durations
+
+
+def _fastest(run, repeat):
+	"""
+	call run() repeat times, each time with an empty sympy cache and, as in timeit, without garbage collection; run
+	returns a result and a list of durations, one per item
+	returns the result of the last run and the fastest duration of every item
+	"""
+	durations = []
+	for _ in range(max(1, repeat)):
+		clear_cache()
+		gc.collect()
+		gc.disable()
+		try:
+			result, run_durations = run()
+		finally:
+			gc.enable()
+		durations.append(run_durations)
+	return result, list(np.min(np.array(durations, dtype=float), axis=0))
+
+
+def calibrate(repeat=3):
+	"""
+	time of a fixed pure python workload (json parsing, dicts, sorting) that does not depend on this repository, the
+	fastest of repeat runs; timings are compared relative to it, see compare
+	"""
+	text = json.dumps([{"id": i, "values": list(range(20)), "name": f"item {i}"} for i in range(300)])
+
+	def workload():
+		start = time.perf_counter()
+		for _ in range(30):
+			index = {}
+			for item in json.loads(text):
+				index.setdefault(item["name"].split()[0], []).append(sum(item["values"]) * item["id"])
+			sorted(str(value) for value in index["item"])
+		return None, [time.perf_counter() - start]
+
+	return _fastest(workload, repeat)[1][0]
+
+
+def _is_close(value, answer, tol=1e-6):
+	try:
+		return abs(float(value) - float(answer)) < tol
+	except (TypeError, ValueError):
+		return False
+
+
+def bench_load(paths, repeat=1):
+	mwps, durations = _fastest(lambda: _time_each(paths, json_to_MWP), repeat)
+	return mwps, _timing(durations)
+
+
+def bench_linearize(mwps, repeat=1):
+	_, diff_durations = _fastest(lambda: _time_each(mwps, lambda mwp: [mwp.compute_diff(i, True)
+																	   for i in range(mwp.num_states)]), repeat)
+	_, seq_durations = _fastest(lambda: _time_each(mwps, lambda mwp: mwp.get_complete_state().to_sequence()), repeat)
+	return {"compute_diff": _timing(diff_durations), "to_sequence": _timing(seq_durations)}
+
+
+def replay(mwp, lins):
+	"""
+	build a new MWP with the text of mwp from one linearization per span
+	"""
+	new = MWP(problem_id=mwp.id, body=mwp.body, question=mwp.question, spans=list(mwp.spans))
+	for lin in lins:
+		update_world_model(new, lin)
+	return new
+
+
+def bench_replay(mwps, repeat=1):
+	"""
+	replay the gold linearizations of every mwp and count how many replays are strongly and weakly equal to the
+	annotation (variable names are assigned by update_world_model, so strong equality can fail on those alone)
+	"""
+	lins = [[mwp.compute_diff(i, True) for i in range(mwp.num_states)] for mwp in mwps]
+
+	def run():
+		durations, strong, weak, errors = [], 0, 0, 0
+		for mwp, lin in zip(mwps, lins):
+			start = time.perf_counter()
+			try:
+				# update_world_model reports ill-formed logical forms on stdout
+				with contextlib.redirect_stdout(io.StringIO()):
+					new = replay(mwp, lin)
+			except Exception:
+				errors += 1
+				continue
+			finally:
+				durations.append(time.perf_counter() - start)
+			if new.parsed:
+				strong += strongly_equal(new, mwp)
+				weak += weakly_equal(new, mwp)
+		return {"strongly_equal": strong, "weakly_equal": weak, "errors": errors}, durations
+
+	counts, durations = _fastest(run, repeat)
+	out = _timing(durations)
+	out.update(counts)
+	return out
+
+
+def _reason(mwp):
+	with contextlib.redirect_stdout(io.StringIO()):
+		return DeterministicReasoner(mwp=mwp).reason()
+
+
+def bench_reason(mwps, repeat=1):
+	"""
+	reasoning latency per problem, and the number of problems whose reasoned ref matches the annotated answer
+	"""
+	def run():
+		durations, correct, errors = [], 0, 0
+		for mwp in mwps:
+			start = time.perf_counter()
+			try:
+				value = _reason(mwp)
+			except Exception:
+				errors += 1
+				continue
+			finally:
+				durations.append(time.perf_counter() - start)
+			if _is_close(value, mwp.get_complete_state().get_answer()):
+				correct += 1
+		return {"correct": correct, "errors": errors}, durations
+
+	counts, durations = _fastest(run, repeat)
+	out = _timing(durations)
+	out.update(counts)
+	return out
+
+
+def bench_metrics(mwps, repeat=1):
+	"""
+	compare every mwp with itself and with its neighbour in the (sorted) corpus
+	"""
+	pairs = [(mwp, mwp) for mwp in mwps] + list(zip(mwps, mwps[1:]))
+	out = {}
+	for name, f in [("strongly_equal", strongly_equal), ("weakly_equal", weakly_equal), ("smatch", smatch)]:
+		results, durations = _fastest(lambda: _time_each(pairs, lambda pair: f(*pair)), repeat)
+		out[name] = _timing(durations)
+		if name != "smatch":
+			out[name]["true"] = int(sum(results))
+
+	def run():
+		start = time.perf_counter()
+		_, _, f1 = corpus_smatch(pairs, processes=1)
+		return f1, [time.perf_counter() - start]
+
+	f1, durations = _fastest(run, repeat)
+	out["corpus_smatch"] = {"total": durations[0], "f1": f1}
+	return out
+
+
+def _name(i):
+	"""
+	alphabetic name for the i-th synthetic entity; the well-formedness filter does not allow digits in names
+	"""
+	return "kind" + _letters(i)
+
+
+def transfer_chain(n):
+	"""
+	synthetic problem with one container and a chain of n transfers alternating between giving and receiving
+	returns the linearizations (one per span) and the answer
+	"""
+	lins = ["container ( tom , 5 , apple , none , none )"]
+	answer = 5
+	for i in range(n):
+		if i % 2:
+			lins.append(f"transfer ( tom , none , {i + 1} , apple , none , none )")
+			answer += i + 1
+		else:
+			lins.append(f"transfer ( none , tom , {i + 1} , apple , none , none )")
+			answer -= i + 1
+	lins.append("container ( tom , none , apple , none , none )")
+	return lins, answer
+
+
+def wide_partwhole(n):
+	"""
+	synthetic problem with n part containers of a single whole asked for in the question
+	"""
+	lins = [f"container ( tom , {i + 1} , {_name(i)} , none , none )" for i in range(n)]
+	question = "container ( tom , none , fruit , none , none )"
+	question += "".join(f" part ( tom , fruit , none , none , tom , {_name(i)} , none , none )" for i in range(n))
+	lins.append(question)
+	return lins, n * (n + 1) // 2
+
+
+def generated(n, seed=0):
+	"""
+	synthetic problem with n relations of mixed types from WorldModelGenerator
+	"""
+	mwp, lins = WorldModelGenerator(seed=seed).generate_with_linearizations(n)
+	return lins, mwp.answer
+
+
+SYNTHETIC = {"transfer_chain": transfer_chain, "wide_partwhole": wide_partwhole, "generated": generated}
+
+
+def synthetic_mwp(kind, n):
+	"""
+	build the synthetic problem kind of size n with update_world_model, return it with its answer
+	"""
+	lins, answer = SYNTHETIC[kind](n)
+	spans = [f"Sentence {i}." for i in range(len(lins) - 1)] + ["How many are there?"]
+	mwp = MWP(problem_id=f"{kind}-{n}", body=" ".join(spans[:-1]), question=spans[-1], spans=spans)
+	with contextlib.redirect_stdout(io.StringIO()):
+		for lin in lins:
+			update_world_model(mwp, lin)
+	return mwp, answer
+
+
+def bench_scaling(sizes, repeat=3):
+	"""
+	time to build (update_world_model) and reason over synthetic problems of every size
+	the minimum over repeat runs is reported
+	"""
+	def run(kind, n):
+		start = time.perf_counter()
+		mwp, answer = synthetic_mwp(kind, n)
+		build = time.perf_counter() - start
+		start = time.perf_counter()
+		value = _reason(mwp)
+		return (mwp, _is_close(value, answer)), [build, time.perf_counter() - start]
+
+	out = {}
+	for kind in SYNTHETIC:
+		out[kind] = {}
+		for n in sizes:
+			(mwp, correct), (build, reason) = _fastest(lambda: run(kind, n), repeat)
+			state = mwp.get_complete_state()
+			out[kind][str(n)] = {"build": build, "reason": reason, "correct": correct,
+								 "containers": len(state.containers), "relations": len(state.relations)}
+	return out
+
+
+def run(paths, sizes, repeat=3, profile=False):
+	"""
+	run all benchmarks and return the results as a dict
+	"""
+	if profile:
+		profiling.reset()
+		profiling.enable()
+	calibration = calibrate(repeat)
+	results = {}
+	mwps, results["load"] = bench_load(paths, repeat)
+	results["linearize"] = bench_linearize(mwps, repeat)
+	results["replay"] = bench_replay(mwps, repeat)
+	results["reason"] = bench_reason(mwps, repeat)
+	results["metrics"] = bench_metrics(mwps, repeat)
+	results["scaling"] = bench_scaling(sizes, repeat)
+	# calibrated before and after the benchmarks, the faster one is kept
+	results["calibration"] = min(calibration, calibrate(repeat))
+	if profile:
+		profiling.disable()
+		results["profile"] = profiling.summary()
+	return results
+
+
+def _round(value, digits=6):
+	if isinstance(value, float):
+		return float(f"{value:.{digits}g}")
+	if isinstance(value, dict):
+		return {key: _round(v, digits) for key, v in value.items()}
+	return value
+
+
+def _flatten(results, prefix=""):
+	for key, value in results.items():
+		if isinstance(value, dict):
+			yield from _flatten(value, f"{prefix}{key}.")
+		else:
+			yield f"{prefix}{key}", value
+
+
+# timing fields, never compared exactly
+TIMING_FIELDS = {"total", "mean", "build", "reason", "max", "per_second", "calibration"} | \
+				{f"p{p}" for p in PERCENTILES}
+# timing fields compared with a tolerance if timings are compared; tail percentiles and totals are too noisy
+COMPARED_TIMINGS = {"mean", "p50", "build", "reason"}
+
+
+def compare(results, baseline, tolerance=TOLERANCE, timings=False):
+	"""
+	return a list of differences between results and baseline
+	counts and scores must be equal; if timings, mean and median timings regress if they are more than tolerance
+	slower than the baseline scaled by the ratio of the calibration times
+	"""
+	current = dict(_flatten(_round(results)))
+	scale = 1.0
+	if baseline.get("calibration") and results.get("calibration"):
+		scale = results["calibration"] / baseline["calibration"]
+	differences = []
+	for key, old in _flatten(baseline):
+		if key.startswith("profile."):
+			continue
+		new = current.get(key)
+		field = key.split(".")[-1]
+		if new is None:
+			differences.append(f"{key}: missing (baseline {old})")
+		elif field in TIMING_FIELDS and isinstance(old, float):
+			if timings and field in COMPARED_TIMINGS and old > 0 and new > old * scale * (1 + tolerance):
+				differences.append(f"{key}: {new:.6g}s vs {old * scale:.6g}s calibrated "
+								   f"({new / old / scale:.2f}x slower)")
+		elif new != old:
+			differences.append(f"{key}: {new} (baseline {old})")
+	return differences
+
+
+def save(results, path):
+	with open(path, "w") as f:
+		json.dump(_round(results), f, indent=2, sort_keys=True)
+		f.write("\n")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="benchmark the world model pipeline")
+	parser.add_argument("--data", default=DATA_PATTERN, help="glob pattern of the annotation files")
+	parser.add_argument("--limit", type=int, default=None, help="only use the first limit annotation files")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[4, 16, 64, 128], help="sizes of the synthetic problems")
+	parser.add_argument("--repeat", type=int, default=3, help="runs of every benchmark, the fastest time is reported")
+	parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline results to compare against")
+	parser.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with the results")
+	parser.add_argument("--output", default=None, help="write the results to this json file")
+	parser.add_argument("--profile", action="store_true", help="include a worldmodel.profiling summary")
+	parser.add_argument("--timings", action="store_true", help="also compare calibrated mean and median timings")
+	parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed relative slowdown of timings")
+	args = parser.parse_args()
+
+	results = run(annotation_paths(args.data, args.limit), args.sizes, args.repeat, args.profile)
+
+	if args.output:
+		save(results, args.output)
+	if args.save_baseline:
+		save(results, args.baseline)
+		print(f"baseline written to {args.baseline}")
+	elif os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			differences = compare(results, json.load(f), args.tolerance, args.timings)
+		print("\n".join(differences) if differences else "no differences to the baseline")
+	else:
+		print(json.dumps(_round(results), indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+	main()
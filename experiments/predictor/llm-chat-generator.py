@@ -10,6 +10,9 @@ from tenacity import (
 
 import pandas as pd
 import csv
+import json
+
+from experiments.probing.completionCache import CompletionCache
 
 dir = os.path.dirname(__file__)
 env_path = os.path.join(dir, "../.env")
@@ -17,21 +20,34 @@ dotenv_path = Path(env_path) ## need a ".env file" with the following line: OPEN
 load_dotenv(dotenv_path=dotenv_path)
 openai.api_key = os.getenv("OPEN_API_KEY")
 
+# sampling parameters of every chat completion, also part of the cache key
+PARAMS = {"temperature": 0, "max_tokens": 200, "top_p": 1, "frequency_penalty": 0.0, "presence_penalty": 0,
+		  "stop": ["\n"]}
+
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(10))
 def chat_generator(messages, model_id="gpt-3.5-turbo-0301"):
     response = openai.ChatCompletion.create(
         model=model_id,
         messages=messages,
-		temperature=0,
-		max_tokens=200,
-		top_p=1,
-		frequency_penalty=0.0,
-		presence_penalty=0,
-		stop=["\n"]
+        **PARAMS
     )
     messages.append({'role': response.choices[0].message.role, 'content': response.choices[0].message.content})
     return response
 
+def cached_chat_generator(messages, model_id="gpt-3.5-turbo-0301"):
+	"""
+	content of the chat completion for messages, answered from the cache if the same messages were sent before
+	the reply is appended to messages as chat_generator does, also when it comes from the cache
+	"""
+	content = cache.get_or_complete(model_id, PARAMS, json.dumps(messages),
+									lambda: chat_generator(list(messages), model_id)["choices"][0].message.content)
+	if content is not None:
+		messages.append({'role': "assistant", 'content': content})
+	return content
+
+# reruns with the same prompts are answered from the cache instead of the api
+cache = CompletionCache("completions.sqlite", mode="read-through")
+
 seed = 5
 
 model = "gpt-3.5-turbo-0301"
@@ -54,13 +70,13 @@ for dataset in datasets:
 		prompt_suffix = "logical form: " + "; ".join([str(lf) for lf in list(dataset[dataset["problem_id"] == pid]["target"])]) + "\n" + "math story problem: "
 		prompt = {"role": "user", "content": prompt_examples + prompt_suffix}
 
-		gen = chat_generator([system_message, prompt])
-		generated.append(gen["choices"][0].message.content.replace(";", ""))
+		gen = cached_chat_generator([system_message, prompt], model_id=model)
+		generated.append(gen.replace(";", ""))
 
 		original = " ".join([str(lf) for lf in list(dataset[dataset["problem_id"] == pid]["source"])])
 		originals.append(original)
 
-	print("dataset finished")
+	print("dataset finished", cache.stats())
 	fields = ['problem_id', 'original', 'generated']
 	out_test = [{"problem_id": problem_ids[i],
 				 "original": originals[i],
@@ -1,4 +1,5 @@
 from experiments.probing.probingModel import OpenAI
+from experiments.probing.completionCache import CompletionCache
 import pandas as pd
 import csv
 # could insert coref preprocessing here
@@ -13,7 +14,9 @@ seed = 5
 model = "code-davinci-002"
 temperature = 0
 presence_penalty = 0.0
-lm = OpenAI(model=model, temperature=temperature, presence_penalty=presence_penalty)
+# reruns with the same prompts are answered from the cache instead of the api
+cache = CompletionCache("completions.sqlite", mode="read-through")
+lm = OpenAI(model=model, temperature=temperature, presence_penalty=presence_penalty, cache=cache)
 
 with open('prompt_examples.txt', 'r') as f:
 	prompt_examples = f.read()
@@ -37,7 +40,7 @@ for dataset in datasets:
 		pred = lm.complete(prompt_examples + prompt_suffix)
 		preds.append(pred)
 		#time.sleep(20)
-	print("dataset finished")
+	print("dataset finished", cache.stats())
 	fields = ['problem_id', 'true', 'pred']
 	out_test = [{"problem_id": list(dataset["problem_id"])[i],
 				 "true": list(dataset["target"])[i],
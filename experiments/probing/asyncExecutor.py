@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    token bucket refilled continuously at rate_per_minute / 60 tokens per second, holding at most capacity tokens
+    a request larger than the capacity is let through once the bucket is full and leaves it in debt
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else max(1, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        async with self.lock:
+            self._refill()
+            needed = min(amount, self.capacity)
+            while self.tokens < needed:
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+
+def estimate_tokens(prompt, max_tokens=200):
+    """
+    rough token count of a request: about 4 characters per prompt token plus the completion budget
+    """
+    return len(prompt) // 4 + max_tokens
+
+
+async def _complete(lm, prompt, admit):
+    if hasattr(lm, "acomplete"):
+        return await lm.acomplete(prompt, admit=admit)
+    # local models have no async api, run them in a worker thread
+    await admit()
+    return await asyncio.to_thread(lm.complete, prompt)
+
+
+async def execute_async(lm, tasks, concurrency=8, requests_per_minute=60, tokens_per_minute=None, max_tokens=200):
+    """
+    complete all prompts in tasks (dict task id -> prompt) with at most concurrency requests in flight
+    requests are admitted by a token bucket on requests per minute and, if given, one on tokens per minute
+    retries with jitter happen per request inside lm.acomplete, and each attempt is admitted by the buckets again
+    returns a dict task id -> completion, with "" for tasks that failed after all retries
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    request_bucket = TokenBucket(requests_per_minute)
+    token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def run(task_id, prompt):
+        async def admit():
+            await request_bucket.acquire()
+            if token_bucket is not None:
+                await token_bucket.acquire(estimate_tokens(prompt, max_tokens))
+
+        async with semaphore:
+            try:
+                return task_id, await _complete(lm, prompt, admit)
+            except Exception as e:
+                print(f"{task_id}: request failed ({e})")
+                return task_id, ""
+
+    results = await asyncio.gather(*[run(task_id, prompt) for task_id, prompt in tasks.items()])
+    return dict(results)
+
+
+def execute(lm, tasks, **kwargs):
+    """
+    synchronous entry point for execute_async
+    """
+    return asyncio.run(execute_async(lm, tasks, **kwargs))
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+MODES = ["read-through", "write-through", "cache-only"]
+
+
+class CompletionCache:
+    """
+    content-addressed prompt -> completion cache stored in a local sqlite file
+    entries are keyed by a hash of the model id, the decoding parameters and the prompt
+    modes:
+        read-through: return cached completions, query the model on a miss and store the result
+        write-through: always query the model and store (overwrite) the result
+        cache-only: never query the model, return None on a miss
+    """
+
+    def __init__(self, path="completions.sqlite", mode="read-through"):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        ## models without an async api complete in worker threads, see asyncExecutor
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, model TEXT, "
+                                "params TEXT, prompt_hash TEXT, completion TEXT, created REAL)")
+        self.connection.commit()
+
+    @staticmethod
+    def key(model_id, params, prompt):
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        key = hashlib.sha256(json.dumps([model_id, params, prompt_hash], sort_keys=True).encode("utf-8")).hexdigest()
+        return key, prompt_hash
+
+    def get(self, model_id, params, prompt):
+        key, _ = self.key(model_id, params, prompt)
+        with self.lock:
+            row = self.connection.execute("SELECT completion FROM completions WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, model_id, params, prompt, completion):
+        key, prompt_hash = self.key(model_id, params, prompt)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)",
+                                    (key, model_id, json.dumps(params, sort_keys=True), prompt_hash, completion,
+                                     time.time()))
+            self.connection.commit()
+
+    def lookup(self, model_id, params, prompt):
+        """
+        return the cached completion, or None if it is missing or the mode does not read from the cache
+        """
+        completion = None if self.mode == "write-through" else self.get(model_id, params, prompt)
+        if completion is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return completion
+
+    def must_complete(self, completion):
+        """
+        return true if the model has to be queried after a lookup returned completion
+        """
+        return completion is None and self.mode != "cache-only"
+
+    def get_or_complete(self, model_id, params, prompt, complete):
+        """
+        return the completion for prompt, calling complete() only on a miss (or always in write-through mode)
+        in cache-only mode a miss returns None
+        """
+        completion = self.lookup(model_id, params, prompt)
+        if self.must_complete(completion):
+            completion = complete()
+            self.put(model_id, params, prompt, completion)
+        return completion
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
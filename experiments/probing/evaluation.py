@@ -6,7 +6,7 @@ import numpy as np
 from sklearn.metrics import accuracy_score, mean_squared_error
 import time
 
-from experiments.probing import helpers, taskBuilder, taskManager, probingModel
+from experiments.probing import helpers, taskBuilder, taskManager, probingModel, asyncExecutor
 
 
 def postprocess_prediction(y_hat):
@@ -76,4 +76,18 @@ def execute_mwp_tasks(lm, tasks, answers):
         Y_gt.append(y_gt)
         if isinstance(lm.model, str): ## str if openAI worldmodel
             time.sleep(2.25) ## need to sleep for 2 seconds --> 30 requests / minute
-    return np.array(Y_hat), np.array(Y_gt)
\ No newline at end of file
+    return np.array(Y_hat), np.array(Y_gt)
+
+def execute_mwp_tasks_async(lm, tasks, answers, concurrency=8, requests_per_minute=60, tokens_per_minute=None):
+    ## keeps up to concurrency requests in flight under the rate limits instead of sleeping after every call
+    completions = asyncExecutor.execute(lm, tasks, concurrency=concurrency, requests_per_minute=requests_per_minute,
+                                        tokens_per_minute=tokens_per_minute)
+    Y_hat = list()
+    Y_gt = list()
+    for mwp_id in tasks.keys():
+        y_hat = postprocess_prediction(completions[mwp_id])
+        y_gt = answers[mwp_id]
+        print(f"{mwp_id}: y_hat: {y_hat}, y_gt: {y_gt}")
+        Y_hat.append(y_hat)
+        Y_gt.append(y_gt)
+    return np.array(Y_hat), np.array(Y_gt)
@@ -1,19 +1,55 @@
 import os
 import random
+import weakref
+import sympy
 from sympy import Rational
 from sympy.core.symbol import Symbol
+from sympy.parsing.sympy_parser import parse_expr
 
 from worldmodel import loader
 from worldmodel.reasoner import DeterministicReasoner
 
 
+## id(state) -> StateSolutions, entries are dropped when the state is garbage collected
+_solutions = {}
+
+
+class StateSolutions:
+    """
+    values of all variables of a state, solved once
+    unlike DeterministicReasoner(state=..., ref=...), this does not set the ref of the state
+    """
+
+    def __init__(self, state):
+        reasoner = DeterministicReasoner()
+        reasoner.state = state
+        self.values = reasoner.solve_all()
+        self.size = (len(state.containers), len(state.relations))
+
+    def resolve(self, expr):
+        ## unresolved variables solve to themselves
+        if isinstance(expr, sympy.core.symbol.Symbol):
+            return self.values.get(expr, expr)
+        return expr.subs(self.values)
+
+
+def solve_state(state):
+    ## cached per state object; a state that has grown since it was solved is solved again
+    solutions = _solutions.get(id(state))
+    if solutions is None or solutions.size != (len(state.containers), len(state.relations)):
+        solutions = StateSolutions(state)
+        if id(state) not in _solutions:
+            weakref.finalize(state, _solutions.pop, id(state), None)
+        _solutions[id(state)] = solutions
+    return solutions
+
+
 def resolve_ref(state, quant):
 
     if quant != None:  ## avoid relations with reference
         if not isinstance(quant, int) and not isinstance(quant, Rational) and not isinstance(quant, float):
             #if quant.is_variable():  ## containers with reference
-            reasoner = DeterministicReasoner(state=state, ref=str(quant))
-            quant = reasoner.reason()
+            quant = solve_state(state).resolve(parse_expr(str(quant)))
             if isinstance(quant, Symbol):
                 if state.has_answer():
                     quant = state.get_answer()
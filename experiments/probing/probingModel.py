@@ -9,6 +9,8 @@ from tenacity import (
 )  # for exponential backoff
 
 
+import copy
+import torch
 #from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from transformers import T5Tokenizer, T5ForConditionalGeneration
@@ -16,19 +18,32 @@ from transformers import BartTokenizer, BartForConditionalGeneration
 
 class OpenAI:
 
-  def __init__(self, model:str="text-davinci-003", temperature=0, presence_penalty=0.0):
+  def __init__(self, model:str="text-davinci-003", temperature=0, presence_penalty=0.0, api_base=None, cache=None):
 
     dir = os.path.dirname(__file__)
     env_path = os.path.join(dir, "../.env")
     dotenv_path = Path(env_path) ## need a ".env file" with the following line: OPEN_API_KEY=<KEY>
     load_dotenv(dotenv_path=dotenv_path)
     openai.api_key = os.getenv("OPEN_API_KEY")
+    if api_base is not None: ## e.g. a local stand-in server with the same completions api
+      openai.api_base = api_base
     self.model = model # text-davinci-003, code-davinci-002 codex, text-curie-001 gpt-2 cheaper
     self.temperature=temperature
     self.presence_penalty=presence_penalty
+    self.cache = cache ## optional CompletionCache
+
+  def params(self):
+    return {"temperature": self.temperature, "max_tokens": 200, "top_p": 1, "frequency_penalty": 0.0,
+            "presence_penalty": self.presence_penalty, "stop": ["\n"]}
 
-  @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(10))
   def complete(self, prompt: str = ""):
+    if self.cache is None:
+      return self._complete(prompt)
+    completion = self.cache.get_or_complete(self.model, self.params(), prompt, lambda: self._complete(prompt))
+    return completion if completion is not None else ""
+
+  @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(10))
+  def _complete(self, prompt: str = ""):
     response = openai.Completion.create(
       model=self.model,
       prompt=prompt,
@@ -41,11 +56,46 @@ class OpenAI:
     )
     return response.choices[0]["text"]
 
+  async def acomplete(self, prompt: str = "", admit=None):
+    ## admit is awaited before every attempt, retries included, e.g. to take a token of a rate limiter
+    if self.cache is None:
+      return await self._acomplete(prompt, admit)
+    completion = self.cache.lookup(self.model, self.params(), prompt)
+    if self.cache.must_complete(completion):
+      completion = await self._acomplete(prompt, admit)
+      self.cache.put(self.model, self.params(), prompt, completion)
+    return completion if completion is not None else ""
+
+  @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(10))
+  async def _acomplete(self, prompt: str = "", admit=None):
+    if admit is not None:
+      await admit()
+    response = await openai.Completion.acreate(
+      model=self.model,
+      prompt=prompt,
+      temperature=self.temperature,
+      max_tokens=200,
+      top_p=1,
+      frequency_penalty=0.0,
+      presence_penalty=self.presence_penalty,
+      stop=["\n"]
+    )
+    return response.choices[0]["text"]
+
 
 
 class Huggingface:
 
-  def __init__(self, model:str="gpt2"):
+  def __init__(self, model:str="gpt2", num_threads:int=None, cache=None):
+
+    self.model_id = model
+    self.cache = cache ## optional CompletionCache
+    self.prefix = (None, None) ## (token ids, past_key_values) of the most recently encoded shared prefix
+
+    ## cpu threads used by torch for generation; torch.set_num_threads is process-wide, so it also changes the
+    ## threads of every other model in the process, and is left at the torch default unless num_threads is given
+    if num_threads is not None:
+      torch.set_num_threads(num_threads)
 
     if model == "gpt2":
       self.tokenizer = AutoTokenizer.from_pretrained(model)
@@ -63,8 +113,23 @@ class Huggingface:
       self.tokenizer = BartTokenizer.from_pretrained("facebook/bart-large-cnn")
       self.model = BartForConditionalGeneration.from_pretrained("facebook/bart-large-cnn")
 
+    self.model.eval()
+    ## batches are padded; gpt2 has no pad token so we reuse eos, as complete does
+    if self.tokenizer.pad_token is None:
+      self.tokenizer.pad_token = self.tokenizer.eos_token
+    ## decoder-only models continue the prompt, so they need left padding
+    self.is_encoder_decoder = self.model.config.is_encoder_decoder
+    if not self.is_encoder_decoder:
+      self.tokenizer.padding_side = "left"
 
   def complete(self, prompt: str = "", num_beams:int=1, max_new_tokens:int=100):
+    if self.cache is None:
+      return self._complete(prompt, num_beams, max_new_tokens)
+    params = {"num_beams": num_beams, "max_new_tokens": max_new_tokens, "do_sample": num_beams <= 1}
+    completion = self.cache.get_or_complete(self.model_id, params, prompt, lambda: self._complete(prompt, num_beams, max_new_tokens))
+    return completion if completion is not None else ""
+
+  def _complete(self, prompt: str = "", num_beams:int=1, max_new_tokens:int=100):
 
     input = self.tokenizer(prompt, return_tensors="pt")
     if num_beams <= 1:
@@ -73,4 +138,95 @@ class Huggingface:
     else:
       outputs = self.model.generate(input_ids=input["input_ids"],attention_mask = input["attention_mask"],max_new_tokens=max_new_tokens,pad_token_id=self.tokenizer.eos_token_id,num_beams=num_beams,return_dict_in_generate=False,output_scores=False,output_hidden_states=False)
       generation_output = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
-    return generation_output
\ No newline at end of file
+    return generation_output
+
+  def complete_batch(self, prompts: list, batch_size:int=8, num_beams:int=1, max_new_tokens:int=100):
+    ## prompts are sorted by token length so that each batch needs little padding
+    ## returns only the newly generated text, in the order of prompts
+    lengths = [len(ids) for ids in self.tokenizer(prompts)["input_ids"]]
+    order = sorted(range(len(prompts)), key=lambda i: lengths[i])
+    generation_output = [None] * len(prompts)
+
+    with torch.no_grad():
+      for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        input = self.tokenizer([prompts[i] for i in batch], return_tensors="pt", padding=True)
+        if num_beams <= 1:
+          outputs = self.model.generate(input_ids=input["input_ids"],attention_mask=input["attention_mask"],max_new_tokens=max_new_tokens,do_sample=True,pad_token_id=self.tokenizer.pad_token_id)
+        else:
+          outputs = self.model.generate(input_ids=input["input_ids"],attention_mask=input["attention_mask"],max_new_tokens=max_new_tokens,pad_token_id=self.tokenizer.pad_token_id,num_beams=num_beams)
+        if not self.is_encoder_decoder: ## drop the (left padded) prompt
+          outputs = outputs[:, input["input_ids"].shape[1]:]
+        for i, text in zip(batch, self.tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+          generation_output[i] = text
+    return generation_output
+
+  def complete_shared_prefix(self, prompts: list, max_new_tokens:int=100, do_sample:bool=True, min_prefix_tokens:int=16):
+    ## prompts are grouped by their longest common token prefix (e.g. the few-shot block of prompt_examples.txt)
+    ## each prefix is encoded once and its past_key_values are reused for every suffix in the group
+    ## only for decoder-only models; encoder-decoder models fall back to complete
+    if self.is_encoder_decoder:
+      return [self.complete(prompt, max_new_tokens=max_new_tokens) for prompt in prompts]
+
+    token_ids = [ids for ids in self.tokenizer(prompts)["input_ids"]]
+    generation_output = [None] * len(prompts)
+    with torch.no_grad():
+      for group, prefix_len in group_by_prefix(token_ids, min_prefix_tokens):
+        past = self.encode_prefix(token_ids[group[0]][:prefix_len]) if prefix_len > 0 else None
+        for i in group:
+          generation_output[i] = self.continue_prefix(past, token_ids[i][prefix_len:], max_new_tokens, do_sample)
+    return generation_output
+
+  def encode_prefix(self, prefix_ids: list):
+    ## the last encoded prefix is kept, so consecutive calls with the same few-shot block encode it only once
+    if self.prefix[0] != prefix_ids:
+      ## return_dict, since models of transformers 3.x return tuples by default
+      outputs = self.model(input_ids=torch.tensor([prefix_ids]), use_cache=True, return_dict=True)
+      self.prefix = (prefix_ids, outputs.past_key_values)
+    return self.prefix[1]
+
+  def continue_prefix(self, past, suffix_ids: list, max_new_tokens:int=100, do_sample:bool=True):
+    ## decodes token by token from the cached prefix, sampling like generate does by default (top 50 tokens)
+    if past is not None and not isinstance(past, tuple): ## cache objects are updated in place, keep the prefix intact
+      past = copy.deepcopy(past)
+    input_ids = torch.tensor([suffix_ids])
+    generated = []
+    for _ in range(max_new_tokens):
+      outputs = self.model(input_ids=input_ids, past_key_values=past, use_cache=True, return_dict=True)
+      logits = outputs.logits[0, -1, :]
+      if do_sample:
+        top = torch.topk(logits, k=50)
+        next_token = top.indices[torch.multinomial(torch.softmax(top.values, dim=-1), 1)].item()
+      else:
+        next_token = torch.argmax(logits).item()
+      if next_token == self.tokenizer.eos_token_id:
+        break
+      generated.append(next_token)
+      input_ids = torch.tensor([[next_token]])
+      past = outputs.past_key_values
+    return self.tokenizer.decode(generated, skip_special_tokens=True)
+
+
+def group_by_prefix(token_ids: list, min_prefix_tokens:int=16):
+  ## groups token sequences that share a common prefix of at least min_prefix_tokens
+  ## returns a list of (indices, prefix length); each suffix keeps at least one token to continue from
+  def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+      if x != y:
+        break
+      n += 1
+    return n
+
+  order = sorted(range(len(token_ids)), key=lambda i: token_ids[i])
+  groups = []
+  for i in order:
+    if groups:
+      group, prefix_len = groups[-1]
+      shared = min(prefix_len, common_prefix(token_ids[group[0]], token_ids[i]), len(token_ids[i]) - 1)
+      if shared >= min_prefix_tokens:
+        groups[-1] = (group + [i], shared)
+        continue
+    groups.append(([i], len(token_ids[i]) - 1))
+  ## a group of one has nothing to share
+  return [(group, prefix_len if len(group) > 1 else 0) for group, prefix_len in groups]
\ No newline at end of file
@@ -1,4 +1,5 @@
 import jsonlines, json
+import hashlib
 import xml.etree.ElementTree as ET
 
 import pandas as pd
@@ -10,22 +11,40 @@ from tqdm import tqdm
 from fractions import Fraction
 
 from preprocessing.split_clauses import *
+from preprocessing.near_duplicates import problem_text, build_index
 
 class Dataset:
 
-	def __init__(self, dataset, fold = None, split_sentences = False, split_questions = False, seed=None):
+	def __init__(self, dataset, fold = None, split_sentences = False, split_questions = False, seed=None, stream=False):
+		if stream and dataset not in ["gsm8k", "mathqa"]:
+			raise ValueError(f"stream mode is only supported for gsm8k and mathqa, not {dataset}")
 		random.seed(seed)
+		# in stream mode (gsm8k and mathqa only) problems are yielded lazily by iterating over the dataset
+		self.data = None
+		self.source = None
+		self.pp_attachments = {}
+		self.stream_split_questions = False
+		self.stream_split_sentences = False
+
 		if dataset == "gsm8k":
-			self.load_gsm8k()
-			self.remove_duplicates()
-			if split_questions:
-				self.split_questions()
-				if split_sentences:
-					self.split_sentences()
+			if stream:
+				self.source = self.stream_gsm8k
+				self.stream_split_questions = split_questions
+				self.stream_split_sentences = split_questions and split_sentences
+			else:
+				self.load_gsm8k()
+				self.remove_duplicates()
+				if split_questions:
+					self.split_questions()
+					if split_sentences:
+						self.split_sentences()
 			self.name = "gsm8k"
 
 		elif dataset == "mathqa":
-			self.load_mathqa()
+			if stream:
+				self.source = self.stream_mathqa
+			else:
+				self.load_mathqa()
 			self.name = "mathqa"
 
 		elif dataset == "asdiv-a":
@@ -60,35 +79,108 @@ class Dataset:
 
 
 	def __getitem__(self, index):
+		if self.data is None:
+			raise TypeError("dataset is in stream mode, iterate over it instead")
 		return self.data[index]
 
 	def __len__(self):
+		if self.data is None:
+			raise TypeError("dataset is in stream mode, length unknown")
 		return len(self.data)
 
+	def __iter__(self):
+		if self.data is not None:
+			return iter(self.data)
+		mwps = self.source()
+		if self.stream_split_questions:
+			mwps = self.iter_split_questions(mwps)
+		if self.stream_split_sentences:
+			mwps = self.iter_split_sentences(mwps)
+		return mwps
+
+	def is_stream(self):
+		"""
+		return true if problems are yielded lazily from the source file
+		"""
+		return self.data is None
+
 	def __str__(self):
 		return self.name
 
 	def load_gsm8k(self):
 		with jsonlines.open("../data/gsm8k/train.jsonl") as f:
-			data = []
-			for obj in f:
-				data.append(obj)
 			newdata = []
-			for i, elem in enumerate(data):
-				if len(elem["question"]) < 5:
-					print("Empty string")
-					continue
-				elem["id"] = "gsm8k-" + str(i)
-				# remove extra whitespaces
-				elem["problem"] = re.sub(' +', ' ', elem["question"]).replace(u'\xa0', u' ').strip()
-				elem["answer"] = elem["answer"].split("\n#### ")[1].strip()
-				newdata.append(elem)
+			for i, elem in enumerate(f):
+				elem = self._clean_gsm8k(elem, i)
+				if elem is not None:
+					newdata.append(elem)
 
 		self.data = newdata
 
+	def _clean_gsm8k(self, elem, i):
+		"""
+		assign id, normalize whitespace and extract the answer of a raw gsm8k object
+		return None if the question is empty
+		"""
+		if len(elem["question"]) < 5:
+			print("Empty string")
+			return None
+		elem["id"] = "gsm8k-" + str(i)
+		# remove extra whitespaces
+		elem["problem"] = re.sub(' +', ' ', elem["question"]).replace(u'\xa0', u' ').strip()
+		elem["answer"] = elem["answer"].split("\n#### ")[1].strip()
+		return elem
+
+	def stream_gsm8k(self):
+		"""
+		yield cleaned and deduplicated gsm8k problems one at a time, without reading the whole file into memory
+		"""
+		seen = set()
+		with jsonlines.open("../data/gsm8k/train.jsonl") as f:
+			for i, elem in enumerate(f):
+				elem = self._clean_gsm8k(elem, i)
+				if elem is not None and self._is_new(elem, seen):
+					yield elem
+
 	def load_mathqa(self):
 		with open("../data/MathQA/train.json") as f:
-			self.data = json.load(f)
+			self.data = [self._clean_mathqa(elem, i) for i, elem in enumerate(json.load(f))]
+
+	def _clean_mathqa(self, elem, i):
+		"""
+		assign id, normalize whitespace and extract the answer of a raw mathqa object
+		the answer is the value of the option marked as correct, e.g. "b" in "a ) 38 , b ) 27.675 , ..."
+		"""
+		elem["id"] = "mathqa-" + str(i)
+		elem["problem"] = re.sub(' +', ' ', elem["Problem"]).replace(u'\xa0', u' ').strip()
+		# split on the option markers only, the values can contain commas, e.g. "a ) rs . 1,200 , b ) ..."
+		options = re.split(r"\s*,?\s*([a-e]) \) ", elem["options"])
+		options = dict(zip(options[1::2], options[2::2]))
+		elem["answer"] = options.get(elem["correct"], "").strip()
+		return elem
+
+	def stream_mathqa(self):
+		"""
+		yield cleaned and deduplicated mathqa problems one at a time
+		the source file is a single json array, which we decode object by object from a buffered read
+		"""
+		seen = set()
+		with open("../data/MathQA/train.json") as f:
+			for i, elem in enumerate(iter_json_array(f)):
+				elem = self._clean_mathqa(elem, i)
+				if self._is_new(elem, seen):
+					yield elem
+
+	def _is_new(self, mwp, seen):
+		"""
+		return true if the problem text has not been seen before and add its hash to seen
+		only a fixed-size digest is kept per problem rather than the full string
+		"""
+		digest = hashlib.blake2b(problem_text(mwp).encode("utf-8"), digest_size=16).digest()
+		if digest in seen:
+			return False
+		seen.add(digest)
+		return True
 
 	def load_asdiv(self, fold):
 		folds = sorted(os.listdir("../data/asdiv-a/folds"))
@@ -249,23 +341,34 @@ class Dataset:
 		problem_set = set()
 		newdata = []
 		for mwp in self.data:
-			if "body" in mwp.keys() and "question" in mwp.keys():
-				problem = mwp["body"] + " " + mwp["question"]
-			else:
-				problem = mwp["problem"]
+			problem = problem_text(mwp)
 			if problem not in problem_set:
 				problem_set.add(problem)
 				newdata.append(mwp)
 		self.data = newdata
 
+	def near_duplicates(self, others = (), threshold = 0.8, **kwargs):
+		"""
+		cluster near-duplicate problems within this dataset and the other datasets
+		problems are compared on number-masked text with a minhash index, see preprocessing/near_duplicates.py
+		return a list of clusters of problem ids
+		"""
+		index = build_index([self] + list(others), **kwargs)
+		return index.clusters(threshold=threshold)
+
 	def split_questions(self):
 		"""
 		Segments into body and question
 		"""
+		self.data = list(self.iter_split_questions(self.data))
+
+	def iter_split_questions(self, mwps):
+		"""
+		Segments into body and question, one problem at a time
+		"""
 		nlp = spacy.load('en_core_web_md')
 		nlp.add_pipe('benepar', config={'worldmodel': 'benepar_en3'})
-		newdata = []
-		for mwp in tqdm(self.data):
+		for mwp in tqdm(mwps):
 			text = list(nlp(mwp["problem"]).sents)
 			sent = text[-1]
 
@@ -286,19 +389,24 @@ class Dataset:
 			mwp["body"] = body.strip()
 			mwp["question"] = question.strip()
 			mwp.pop('problem', None)
-			newdata.append(mwp)
-
-		self.data = newdata
+			yield mwp
 
 	def split_sentences(self):
 		"""
 		Segments sentences that contain multiple clauses
 		"""
+		self.pp_attachments = {}
+		self.data = list(self.iter_split_sentences(self.data))
+
+	def iter_split_sentences(self, mwps):
+		"""
+		Segments sentences that contain multiple clauses, one problem at a time
+		pp attachment phrases are collected in self.pp_attachments as problems are consumed
+		"""
 		nlp = spacy.load('en_core_web_md')
 		nlp.add_pipe('benepar', config={'worldmodel': 'benepar_en3'})
-		newdata = []
-		pp_attachment_dict = {}
-		for mwp in tqdm(self.data):
+		pp_attachment_dict = self.pp_attachments
+		for mwp in tqdm(mwps):
 			text = list(nlp(mwp["body"]).sents)
 			body = ""
 			spans = []
@@ -338,7 +446,51 @@ class Dataset:
 			mwp["body"] = body.strip()
 			#mwp["spans"] = dict(zip( range(len(spans)), spans ))
 			mwp["spans"] = spans
-			newdata.append(mwp)
-
-		self.data = newdata
-		self.pp_attachments = pp_attachment_dict
\ No newline at end of file
+			yield mwp
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+	"""
+	yield the objects of a top-level json array in file f one at a time
+	reads f in chunks of chunk_size characters so that the whole array is never held in memory
+	"""
+	decoder = json.JSONDecoder()
+	buffer = ""
+	started = False
+	eof = False
+	while True:
+		buffer = buffer.lstrip()
+		if not started:
+			if not buffer and not eof:
+				chunk = f.read(chunk_size)
+				eof = chunk == ""
+				buffer += chunk
+				continue
+			if not buffer.startswith("["):
+				raise ValueError("expected a json array")
+			buffer = buffer[1:]
+			started = True
+			continue
+		if buffer.startswith(","):
+			buffer = buffer[1:]
+			continue
+		if buffer.startswith("]"):
+			return
+		try:
+			obj, end = decoder.raw_decode(buffer)
+		except json.JSONDecodeError:
+			if eof:
+				raise
+			chunk = f.read(chunk_size)
+			eof = chunk == ""
+			buffer += chunk
+			continue
+		# a value that ends the buffer may be cut off (a number split at a chunk boundary decodes fine), so only
+		# accept it once the next separator is in the buffer
+		if not eof and buffer[end:].lstrip()[:1] not in [",", "]"]:
+			chunk = f.read(chunk_size)
+			eof = chunk == ""
+			buffer += chunk
+			continue
+		yield obj
+		buffer = buffer[end:]
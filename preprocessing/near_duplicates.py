@@ -0,0 +1,179 @@
+import itertools
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+# numbers as they occur in problem text: integers, decimals, fractions and thousands separators
+# a comma is only part of a number between groups of three digits, so "5, 6" and "5,6" are two numbers
+NUMBER_REGEX = re.compile(r"(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?(?:/\d+)?|\.\d+")
+
+# mersenne prime used for the universal hash family (a * x + b) mod p
+PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def mask_numbers(text):
+	"""
+	replace every number in text by a placeholder number0, number1, ...
+	this is the inverse of Dataset.impute_numbers, so that templated problems that only differ in their
+	numbers get the same masked text
+	"""
+	counter = itertools.count()
+	return NUMBER_REGEX.sub(lambda match: f"number{next(counter)}", text)
+
+
+def shingles(text, k=3):
+	"""
+	return the set of word k-grams of the lowercased number-masked text
+	"""
+	tokens = re.findall(r"\w+|[^\w\s]", mask_numbers(text).lower())
+	if len(tokens) < k:
+		return {" ".join(tokens)}
+	return {" ".join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}
+
+
+class MinHashIndex:
+	"""
+	locality sensitive hashing index over minhash signatures of number-masked problem texts
+	signatures are split into bands, and two problems are candidates if they agree on all rows of some band
+	building the index and collecting candidates is linear in the number of problems (plus the candidate pairs)
+	"""
+
+	def __init__(self, num_perm=128, bands=32, k=3, seed=1):
+		if num_perm % bands != 0:
+			raise ValueError("num_perm must be divisible by bands")
+		self.num_perm = num_perm
+		self.bands = bands
+		self.rows = num_perm // bands
+		self.k = k
+
+		rng = np.random.RandomState(seed)
+		self.a = rng.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+		self.b = rng.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+
+		# key -> signature
+		self.signatures = {}
+		# one dict per band from band hash to keys
+		self.buckets = [defaultdict(list) for _ in range(bands)]
+
+	def __len__(self):
+		return len(self.signatures)
+
+	def __contains__(self, key):
+		return key in self.signatures
+
+	def signature(self, text):
+		"""
+		return the minhash signature of text as an array of num_perm hash values
+		"""
+		hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles(text, self.k)], dtype=np.uint64)
+		# (a * x + b) mod p, computed for all permutations and shingles at once
+		permuted = (np.outer(hashes, self.a) + self.b) % PRIME & MAX_HASH
+		return permuted.min(axis=0)
+
+	def add(self, key, text):
+		"""
+		add the problem text under key
+		"""
+		if key in self.signatures:
+			raise ValueError(f"key {key} already in index")
+		sig = self.signature(text)
+		self.signatures[key] = sig
+		for band, bucket in enumerate(self.buckets):
+			bucket[self._band_key(sig, band)].append(key)
+
+	def _band_key(self, sig, band):
+		return sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+	def similarity(self, key1, key2):
+		"""
+		estimated jaccard similarity between two indexed problems
+		"""
+		return float(np.mean(self.signatures[key1] == self.signatures[key2]))
+
+	def query(self, text, threshold=0.8):
+		"""
+		return the keys of indexed problems that are near-duplicates of text, most similar first
+		"""
+		sig = self.signature(text)
+		candidates = set()
+		for band, bucket in enumerate(self.buckets):
+			candidates.update(bucket.get(self._band_key(sig, band), []))
+		scored = [(key, float(np.mean(self.signatures[key] == sig))) for key in candidates]
+		scored = [(key, score) for key, score in scored if score >= threshold]
+		return [key for key, _ in sorted(scored, key=lambda x: x[1], reverse=True)]
+
+	def candidate_pairs(self):
+		"""
+		yield every pair of keys that share at least one band bucket, each pair once
+		"""
+		seen = set()
+		for bucket in self.buckets:
+			for keys in bucket.values():
+				for i in range(len(keys)):
+					for j in range(i + 1, len(keys)):
+						pair = (keys[i], keys[j])
+						if pair not in seen:
+							seen.add(pair)
+							yield pair
+
+	def clusters(self, threshold=0.8):
+		"""
+		group indexed problems into clusters of near-duplicates
+		candidate pairs with estimated similarity of at least threshold are merged with union-find
+		only clusters with more than one problem are returned
+		"""
+		parent = {key: key for key in self.signatures}
+
+		def find(key):
+			while parent[key] != key:
+				parent[key] = parent[parent[key]]
+				key = parent[key]
+			return key
+
+		for key1, key2 in self.candidate_pairs():
+			if self.similarity(key1, key2) >= threshold:
+				parent[find(key1)] = find(key2)
+
+		groups = defaultdict(list)
+		for key in self.signatures:
+			groups[find(key)].append(key)
+		return [sorted(group) for group in groups.values() if len(group) > 1]
+
+
+def problem_text(mwp):
+	"""
+	text of a problem dict, either body and question or the full problem
+	"""
+	if "body" in mwp.keys() and "question" in mwp.keys():
+		return mwp["body"] + " " + mwp["question"]
+	else:
+		return mwp["problem"]
+
+
+def build_index(datasets, **kwargs):
+	"""
+	build a MinHashIndex over all problems in the given datasets (iterables of problem dicts)
+	problems are keyed by their id
+	"""
+	index = MinHashIndex(**kwargs)
+	for dataset in datasets:
+		for mwp in dataset:
+			index.add(mwp["id"], problem_text(mwp))
+	return index
+
+
+def find_leakage(train, test, threshold=0.8, **kwargs):
+	"""
+	return a dict from test problem id to the ids of near-duplicate train problems
+	only test problems with at least one near-duplicate are included
+	"""
+	index = build_index([train], **kwargs)
+	leaks = {}
+	for mwp in test:
+		matches = index.query(problem_text(mwp), threshold=threshold)
+		if matches:
+			leaks[mwp["id"]] = matches
+	return leaks
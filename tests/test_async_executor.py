@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+openai = pytest.importorskip("openai")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from experiments.probing import asyncExecutor, evaluation, probingModel
+
+REQUESTS_PER_MINUTE = 240
+# prompt -> http statuses returned before the request succeeds
+FAILURES = {"question 1": [429, 500], "question 4": [429], "question 6": [500]}
+TASKS = {f"mwp-{i}": f"question {i}" for i in range(8)}
+
+
+class CompletionServer(ThreadingHTTPServer):
+	"""
+	stand-in for the completions endpoint: answers "completion of <prompt>", after the failures planned for the prompt
+	"""
+
+	def __init__(self, failures):
+		super().__init__(("127.0.0.1", 0), CompletionHandler)
+		self.failures = {prompt: list(statuses) for prompt, statuses in failures.items()}
+		self.lock = threading.Lock()
+		self.times = []
+		self.attempts = defaultdict(int)
+
+	@property
+	def url(self):
+		return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+
+	def do_POST(self):
+		request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+		prompt = request["prompt"]
+		with self.server.lock:
+			self.server.times.append(time.monotonic())
+			self.server.attempts[prompt] += 1
+			failures = self.server.failures.get(prompt)
+			status = failures.pop(0) if failures else 200
+		if status == 200:
+			body = {"id": "cmpl-0", "object": "text_completion", "created": 0, "model": request["model"],
+					"choices": [{"text": f"completion of {prompt}", "index": 0, "logprobs": None, "finish_reason": "stop"}],
+					"usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+		else:
+			body = {"error": {"message": f"status {status}", "type": "server_error", "param": None, "code": None}}
+		data = json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, *args):
+		pass
+
+
+@pytest.fixture
+def server():
+	server = CompletionServer(FAILURES)
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	yield server
+	server.shutdown()
+	server.server_close()
+
+
+@pytest.fixture
+def lm(server, monkeypatch):
+	monkeypatch.setenv("OPEN_API_KEY", "test")
+	monkeypatch.setattr(openai, "api_key", openai.api_key)
+	monkeypatch.setattr(openai, "api_base", openai.api_base)
+	return probingModel.OpenAI(model="stub", api_base=server.url)
+
+
+def assert_within_rate(times, requests_per_minute):
+	# a bucket admits at most its capacity at once and then rate requests per second, one request of slack for timing
+	rate = requests_per_minute / 60
+	capacity = max(1, rate)
+	times = sorted(times)
+	for i in range(len(times)):
+		for j in range(i, len(times)):
+			assert j - i + 1 <= capacity + rate * (times[j] - times[i]) + 1
+
+
+def test_execute_async_retries_within_rate(server, lm):
+	results = asyncExecutor.execute(lm, TASKS, concurrency=4, requests_per_minute=REQUESTS_PER_MINUTE)
+
+	assert results == {task_id: f"completion of {prompt}" for task_id, prompt in TASKS.items()}
+	assert dict(server.attempts) == {prompt: 1 + len(FAILURES.get(prompt, [])) for prompt in TASKS.values()}
+	assert len(server.times) == len(TASKS) + sum(len(statuses) for statuses in FAILURES.values())
+	assert_within_rate(server.times, REQUESTS_PER_MINUTE)
+
+
+def test_execute_mwp_tasks_async(server, lm):
+	answers = {task_id: float(prompt.split()[-1]) for task_id, prompt in TASKS.items()}
+	Y_hat, Y_gt = evaluation.execute_mwp_tasks_async(lm, TASKS, answers, concurrency=4,
+													  requests_per_minute=REQUESTS_PER_MINUTE)
+
+	assert list(Y_hat) == list(Y_gt) == [answers[task_id] for task_id in TASKS]
+	assert_within_rate(server.times, REQUESTS_PER_MINUTE)
@@ -0,0 +1,36 @@
+import pytest
+
+from worldmodel.database import WorldModelDatabase, export_corpus
+from worldmodel.loader import json_to_MWP
+
+# two different problems with the same id
+ASDIV = "output_files/data/asdiv/train/mawps-19.json"
+MAWPS = "output_files/data/mawps/test/mawps-19.json"
+
+
+def test_duplicate_id_raises(tmp_path):
+	database = WorldModelDatabase(str(tmp_path / "worldmodels.sqlite"))
+	database.add(json_to_MWP(ASDIV))
+
+	with pytest.raises(ValueError, match="mawps-19"):
+		database.add(json_to_MWP(MAWPS))
+	assert database.mwp("mawps-19").body == json_to_MWP(ASDIV).body
+
+
+def test_duplicate_id_replace(tmp_path):
+	database = WorldModelDatabase(str(tmp_path / "worldmodels.sqlite"))
+	database.add(json_to_MWP(ASDIV))
+	database.add(json_to_MWP(MAWPS), replace=True)
+
+	assert database.problem_ids() == ["mawps-19"]
+	assert database.mwp("mawps-19").body == json_to_MWP(MAWPS).body
+	assert database.query("SELECT COUNT(*) FROM states")[0][0] == json_to_MWP(MAWPS).num_states
+
+
+def test_export_keys(tmp_path):
+	mwps = [json_to_MWP(ASDIV), json_to_MWP(MAWPS)]
+	keys = ["asdiv/train/mawps-19", "mawps/test/mawps-19"]
+	database = export_corpus(mwps, str(tmp_path / "worldmodels.sqlite"), keys=keys)
+
+	assert database.problem_ids() == keys
+	assert database.mwp("mawps/test/mawps-19").body == mwps[1].body
@@ -0,0 +1,51 @@
+import io
+import json
+
+import pytest
+
+from preprocessing.dataset import Dataset, iter_json_array
+
+VALUES = [1, 23, 456, -7.5e3, "a", "a longer string, with [brackets] and \"quotes\"", True, None,
+		  {"id": 1, "nested": {"list": [1, 2, {"x": "y"}], "empty": {}}}, [], [[1, 2], [3]], 0.125]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64])
+def test_iter_json_array_chunk_boundaries(chunk_size):
+	text = json.dumps(VALUES)
+	assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == VALUES
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3])
+def test_iter_json_array_whitespace(chunk_size):
+	text = "  [ 1 ,\n 23 ,  456\n ]  "
+	assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == [1, 23, 456]
+
+
+def test_iter_json_array_scalars_split():
+	assert list(iter_json_array(io.StringIO("[1, 23, 456]"), chunk_size=2)) == [1, 23, 456]
+
+
+def test_iter_json_array_empty():
+	assert list(iter_json_array(io.StringIO("[]"), chunk_size=1)) == []
+
+
+def test_iter_json_array_not_an_array():
+	with pytest.raises(ValueError):
+		list(iter_json_array(io.StringIO("{}"), chunk_size=1))
+
+
+@pytest.mark.parametrize("correct, answer", [
+	("a", "rs . 1,200"), ("b", "27.675"), ("c", "rs . 12,50,000"), ("e", "none"),
+])
+def test_clean_mathqa_options_with_commas(correct, answer):
+	dataset = Dataset("mathqa", stream=True)
+	elem = {"Problem": "a  problem", "correct": correct,
+			"options": "a ) rs . 1,200 , b ) 27.675 , c ) rs . 12,50,000 , d ) 3 , e ) none"}
+	elem = dataset._clean_mathqa(elem, 4)
+	assert (elem["id"], elem["problem"], elem["answer"]) == ("mathqa-4", "a problem", answer)
+
+
+@pytest.mark.parametrize("name", ["asdiv-a", "svamp", "mawps", "all-arith"])
+def test_stream_unsupported(name):
+	with pytest.raises(ValueError, match=name):
+		Dataset(name, stream=True)
@@ -0,0 +1,20 @@
+from worldmodel import loader
+
+LIN = "container ( tom , 5 , apple , none , none )"
+
+
+def test_well_formed_pattern_expands_raw_vocab_only(monkeypatch):
+	expanded = []
+
+	def expand_vocab(words):
+		expanded.append(list(words))
+		return frozenset(words) | {"none"}
+
+	monkeypatch.setattr(loader, "expand_vocab", expand_vocab)
+	pattern = loader.well_formed_pattern(frozenset(["tom", "apple", "none"]))
+	assert loader.keep_well_formed(LIN, pattern=pattern) == LIN
+	assert expanded == []
+
+	pattern = loader.well_formed_pattern(["tom", "apple"])
+	assert loader.keep_well_formed(LIN, pattern=pattern) == LIN
+	assert expanded == [["tom", "apple"]]
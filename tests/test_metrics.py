@@ -0,0 +1,67 @@
+import glob
+
+import pytest
+
+from worldmodel.container import Container
+from worldmodel.loader import json_to_MWP
+from worldmodel.metrics import smatch, corpus_smatch
+from worldmodel.relation import Transfer
+from worldmodel.state import State
+
+PATHS = sorted(glob.glob("output_files/data/mawps/train/*.json"))[:20]
+
+
+def state(*containers):
+	out = State("p", "")
+	for id, label, quantity, entity in containers:
+		out.add_container(Container(id, label, entity, quantity=quantity))
+	return out
+
+
+@pytest.fixture(scope="module")
+def mwps():
+	return [json_to_MWP(path) for path in PATHS]
+
+
+def test_smatch_identical(mwps):
+	for mwp in mwps:
+		assert smatch(mwp, mwp) == (1.0, 1.0, 1.0)
+		assert smatch(mwp, mwp, full=False) == (1.0, 1.0, 1.0)
+
+
+def test_smatch_disjoint():
+	assert smatch(state((1, "tom", "5", "apple")), State("p", "")) == (0.0, 0.0, 0.0)
+	# containers with no common label, quantity or entity only match on their instance triples
+	precision, recall, f1 = smatch(state((1, "tom", "5", "apple")), state((1, "mary", "3", "pear")))
+	assert (precision, recall, f1) == (0.25, 0.25, 0.25)
+
+
+def test_smatch_partial_overlap():
+	# 4 triples per container (instance, name, quant, entity); the best alignment maps c1 -> c1 (4) and c2 -> c2
+	# (3, the quantities differ), so 7 of 8 predicted and 7 of 12 gold triples match
+	pred = state((1, "tom", "5", "apple"), (2, "mary", "3", "pear"))
+	gold = state((2, "tom", "5", "apple"), (1, "mary", "4", "pear"), (3, "sue", "2", "kiwi"))
+	precision, recall, f1 = smatch(pred, gold)
+	assert precision == pytest.approx(7 / 8)
+	assert recall == pytest.approx(7 / 12)
+	assert f1 == pytest.approx(14 / 20)
+
+
+def test_smatch_relation_edges():
+	# 14 triples on each side: 4 per container and a transfer with instance, quant, entity, recipient and 2 edges
+	# the gold transfer goes the other way, so either the containers align (12 without the edges) or they are swapped
+	# (6 for the containers, 4 for the transfer and both edges), 12 of 14 either way
+	pred = state((1, "tom", "5", "apple"), (2, "tom", "x", "apple"))
+	gold = state((1, "tom", "5", "apple"), (2, "tom", "x", "apple"))
+	tuple = pred.containers[1].tuple
+	pred.add_relation(Transfer(3, pred.containers[1], pred.containers[2], "2", tuple, recipient="tom"))
+	gold.add_relation(Transfer(3, gold.containers[2], gold.containers[1], "2", tuple, recipient="tom"))
+	assert smatch(pred, gold) == pytest.approx((12 / 14, 12 / 14, 12 / 14))
+	assert smatch(pred, pred) == (1.0, 1.0, 1.0)
+
+
+def test_corpus_smatch_processes(mwps):
+	pairs = list(zip(mwps, mwps[1:])) + [(mwp, mwp) for mwp in mwps]
+	serial = corpus_smatch(pairs, processes=1)
+	assert corpus_smatch(pairs, processes=2) == serial
+	assert 0.0 < serial[2] < 1.0
@@ -0,0 +1,57 @@
+import pytest
+
+from preprocessing.near_duplicates import mask_numbers, shingles, build_index, find_leakage
+
+
+def test_mask_numbers_separating_comma():
+	assert mask_numbers("5, 6 apples") == "number0, number1 apples"
+	assert mask_numbers("5,6 apples") == "number0,number1 apples"
+	assert shingles("5, 6 apples") == shingles("5,6 apples")
+
+
+def test_mask_numbers_thousands_decimals_fractions():
+	assert mask_numbers("1,000 apples and 12,345.5 pears") == "number0 apples and number1 pears"
+	assert mask_numbers("3/4 of .5") == "number0 of number1"
+
+
+TOM = "How many apples does Tom have now?"
+TRAIN = "How far does the train travel?"
+PROBLEMS = [
+	{"id": "a1", "body": "Tom has 5 apples. He gives 2 apples to Mary.", "question": TOM},
+	{"id": "a2", "body": "Tom has 12 apples. He gives 7 apples to Mary.", "question": TOM},
+	{"id": "a3", "body": "Tom has 1,200 apples. He gives 300 apples to Mary.", "question": TOM},
+	{"id": "b1", "body": "A train travels 60 miles per hour for 3 hours.", "question": TRAIN},
+	{"id": "b2", "body": "A train travels 45 miles per hour for 2 hours.", "question": TRAIN},
+	{"id": "c1", "problem": "Sara baked 24 cookies and ate 4 of them. How many cookies are left in the jar?"},
+]
+
+
+def test_min_hash_index_clusters_templated_problems():
+	index = build_index([PROBLEMS], seed=3)
+	assert len(index) == len(PROBLEMS)
+	assert "a1" in index
+	assert sorted(index.clusters()) == [["a1", "a2", "a3"], ["b1", "b2"]]
+	pairs = {tuple(sorted(pair)) for pair in index.candidate_pairs()}
+	assert {("a1", "a2"), ("a1", "a3"), ("a2", "a3"), ("b1", "b2")} <= pairs
+	assert all(index.similarity(*pair) < 0.8 for pair in pairs if pair[0][0] != pair[1][0])
+
+
+def test_min_hash_index_query():
+	index = build_index([PROBLEMS], seed=3)
+	assert sorted(index.query("Tom has 3 apples. He gives 1 apples to Mary. How many apples does Tom have now?")) == \
+		["a1", "a2", "a3"]
+	assert index.query("Jane reads 10 pages of a book every day for a week. How many pages does she read?") == []
+	with pytest.raises(ValueError):
+		index.add("a1", "duplicate key")
+
+
+def test_min_hash_index_deterministic():
+	first, second = build_index([PROBLEMS], seed=3), build_index([PROBLEMS], seed=3)
+	assert all((first.signatures[key] == second.signatures[key]).all() for key in first.signatures)
+
+
+def test_find_leakage():
+	train = [p for p in PROBLEMS if p["id"] in ["a1", "b1", "c1"]]
+	unrelated = {"id": "d1", "problem": "Jane reads 10 pages of a book every day. How many pages does she read?"}
+	test = [p for p in PROBLEMS if p["id"] in ["a2", "b2"]] + [unrelated]
+	assert find_leakage(train, test, seed=3) == {"a2": ["a1"], "b2": ["b1"]}
@@ -0,0 +1,237 @@
+import glob
+import sys
+
+import pytest
+import sympy
+from sympy import solve
+
+from worldmodel.container import Container
+from worldmodel.loader import json_to_MWP
+from worldmodel.reasoner import DeterministicReasoner, IncrementalReasoner, SolveLimits, OK, TIMEOUT, MAX_DEPTH, \
+	MAX_SOLVE_CALLS, MAX_EXPRESSION_SIZE
+from worldmodel.relation import PartWhole, Transfer
+from worldmodel.state import State
+
+a, b, t, w, x, y, z = sympy.symbols("a b t w x y z")
+
+SYSTEMS = {
+	"chain": (z, [x - 5, y - x - 3, z - 2 * y]),
+	"shared_whole": (t, [w - a - b, a - 2, b - a - 1, t - 2 * w, t - w - a - b]),
+	"cycle": (x, [x + y - 10, x - y - 2, y - 4]),
+	"inconsistent": (y, [x - 5, x - 6, y - x - 1]),
+	"underdetermined": (z, [x + y - 10, z - x]),
+	"partly_determined": (w, [x + y - 10, w - a - 3, a - 2 * b, b - 1.5]),
+}
+
+
+def plain_recursive_solver(target_var, equations):
+	"""
+	the recursive solver without memoization, visited equations as a list (as DeterministicReasoner had it first)
+	"""
+	def _recursive_solver(target_var, visited):
+		eqs = [eq for eq in equations if eq not in visited and isinstance(eq, sympy.Basic)
+			   and target_var in eq.free_symbols]
+		eqs = sorted(eqs, key=lambda x: len(x.free_symbols))
+		for eq in eqs:
+			if len(eq.free_symbols) == 1:
+				return solve(eq, target_var)[0]
+			for other_var in eq.free_symbols.difference({target_var}):
+				eq = eq.subs({other_var: _recursive_solver(other_var, visited + [eq])})
+			if len(eq.free_symbols) == 1:
+				return solve(eq, target_var)[0]
+		return target_var
+
+	return _recursive_solver(target_var, [])
+
+
+@pytest.mark.parametrize("name", sorted(SYSTEMS))
+def test_recursive_solver_matches_plain(name):
+	target, equations = SYSTEMS[name]
+	reasoner = DeterministicReasoner()
+	assert reasoner.recursive_solver(target, equations) == plain_recursive_solver(target, equations)
+	assert reasoner.status == OK
+
+
+def test_recursive_solver_cases():
+	reasoner = DeterministicReasoner()
+	assert reasoner.recursive_solver(*SYSTEMS["chain"]) == 16
+	assert reasoner.recursive_solver(*SYSTEMS["inconsistent"]) == 6
+	assert reasoner.recursive_solver(*SYSTEMS["underdetermined"]) == z
+
+
+def test_recursive_solver_shared_memo():
+	target, equations = SYSTEMS["shared_whole"]
+	reasoner = DeterministicReasoner()
+	memo = {}
+	assert reasoner.recursive_solver(target, equations, memo=memo) == 10
+	assert memo[w] == 5
+	assert reasoner.recursive_solver(w, equations, memo=memo) == 5
+
+
+def test_recursive_solver_matches_plain_on_corpus():
+	compared = 0
+	for path in sorted(glob.glob("output_files/data/mawps/train/*.json"))[:60]:
+		mwp = json_to_MWP(path)
+		if not mwp.determined:
+			continue
+		reasoner = DeterministicReasoner(mwp=mwp)
+		ref = reasoner.state.get_ref()
+		if not isinstance(ref, sympy.Symbol):
+			continue
+		equations = reasoner.get_equations()
+		try:
+			expected = plain_recursive_solver(ref, equations)
+		except RecursionError:
+			continue
+		assert reasoner.recursive_solver(ref, equations) == expected
+		compared += 1
+	assert compared > 40
+
+
+def _solvable(limit=40):
+	for path in sorted(glob.glob("output_files/data/mawps/train/*.json"))[:limit]:
+		mwp = json_to_MWP(path)
+		if mwp.determined:
+			value = DeterministicReasoner(mwp=mwp).reason()
+			if not getattr(value, "free_symbols", None):
+				yield path, mwp, float(value)
+
+
+def test_compile_ref_defaults_equal_reason():
+	compared = 0
+	for _, mwp, value in _solvable():
+		compiled = DeterministicReasoner(mwp=mwp).compile_ref()
+		assert float(compiled()) == pytest.approx(value)
+		assert float(compiled.evaluate([compiled.defaults])[0]) == pytest.approx(value)
+		compared += 1
+	assert compared > 20
+
+
+def test_compile_ref_changed_input_equals_resolved():
+	compared = 0
+	for path, mwp, _ in _solvable():
+		compiled = DeterministicReasoner(mwp=mwp).compile_ref()
+		(kind, id), default = compiled.inputs[0], compiled.defaults[0]
+		# the same problem with that quantity changed, reasoned from scratch
+		changed = json_to_MWP(path)
+		state = changed.get_complete_state()
+		obj = state.containers[id] if kind == "container" else state.relations[id]
+		obj.quantity.num = default + 7
+		expected = float(DeterministicReasoner(mwp=changed).reason())
+		assert float(compiled({(kind, id): default + 7})) == pytest.approx(expected)
+		assert compiled({(kind, id): [default, default + 7]}).shape == (2,)
+		compared += 1
+	assert compared > 20
+
+
+def test_compile_ref_undetermined():
+	mwp = json_to_MWP("output_files/data/mawps/train/mawps-242.json")
+	with pytest.raises(ValueError):
+		DeterministicReasoner(mwp=mwp).compile_ref()
+
+
+@pytest.mark.parametrize("limits, status", [
+	(SolveLimits(time=0), TIMEOUT),
+	(SolveLimits(depth=1), MAX_DEPTH),
+	(SolveLimits(solve_calls=1), MAX_SOLVE_CALLS),
+	(SolveLimits(expression_size=2), MAX_EXPRESSION_SIZE),
+])
+def test_limits_return_status(limits, status):
+	target, equations = SYSTEMS["chain"]
+	reasoner = DeterministicReasoner(limits=limits)
+	assert reasoner.recursive_solver(target, equations) == target
+	assert reasoner.status == status
+
+
+@pytest.mark.parametrize("limits, status", [
+	(SolveLimits(time=0), TIMEOUT),
+	(SolveLimits(solve_calls=0), MAX_SOLVE_CALLS),
+	(SolveLimits(expression_size=2), MAX_EXPRESSION_SIZE),
+])
+def test_limits_solve_all_and_update(limits, status):
+	_, mwp, _ = next(_solvable())
+	ref = mwp.get_complete_state().get_ref()
+	reasoner = DeterministicReasoner(mwp=mwp, limits=limits)
+	assert reasoner.solve_all()[ref] == ref
+	assert reasoner.status == status
+
+	incremental = IncrementalReasoner(limits=limits)
+	assert incremental.update(mwp.get_complete_state())[ref] == ref
+	assert incremental.status == status
+
+
+def test_limits_within_budget():
+	target, equations = SYSTEMS["chain"]
+	reasoner = DeterministicReasoner(limits=SolveLimits(time=10, depth=10, solve_calls=10, expression_size=50))
+	assert reasoner.recursive_solver(target, equations) == 16
+	assert reasoner.status == OK
+
+
+def test_limits_reason_returns_unresolved_ref():
+	_, mwp, _ = next(_solvable())
+	reasoner = DeterministicReasoner(mwp=mwp, limits=SolveLimits(solve_calls=0))
+	assert reasoner.reason() == mwp.get_complete_state().get_ref()
+	assert reasoner.status == MAX_SOLVE_CALLS
+
+
+def test_recursion_limit_returns_max_depth():
+	symbols = sympy.symbols("v0:600")
+	equations = [symbols[0] - 1] + [symbols[i] - symbols[i - 1] - 1 for i in range(1, len(symbols))]
+	limit = sys.getrecursionlimit()
+	sys.setrecursionlimit(300)
+	try:
+		reasoner = DeterministicReasoner()
+		assert reasoner.recursive_solver(symbols[-1], equations) == symbols[-1]
+	finally:
+		sys.setrecursionlimit(limit)
+	assert reasoner.status == MAX_DEPTH
+
+
+def growing_whole(n):
+	"""
+	states 1..n where state i adds the part i to the whole x0, with a transfer of 1 from x0 to y and a separate
+	chain of transfers z1..z5 from 3
+	"""
+	state = State("p", "")
+	state.add_container(Container(0, "tom", "apple", quantity="x0"))
+	state.add_container(Container(1000, "tom", "apple", quantity="y"))
+	state.add_container(Container(1100, "ann", "pear", quantity="3"))
+	for j in range(1, 6):
+		state.add_container(Container(1100 + j, "ann", "pear", quantity=f"z{j}"))
+	containers = state.containers
+	state.add_relation(Transfer(2000, containers[0], containers[1000], "1", containers[0].tuple, sender="tom"))
+	for j in range(1, 6):
+		source, target = containers[1099 + j], containers[1100 + j]
+		state.add_relation(Transfer(2100 + j, source, target, "1", source.tuple, recipient="ann"))
+	states = []
+	for i in range(1, n + 1):
+		state = state.copy()
+		state.add_container(Container(i, "tom", "apple", quantity=str(i), attribute=f"a{i}"))
+		state.add_relation(PartWhole(2000 + i, source=state.containers[i], target=state.containers[0]))
+		states.append(state)
+	return states
+
+
+def test_incremental_growing_whole_solve_calls():
+	x0, y, z5 = sympy.symbols("x0 y z5")
+	reasoner = IncrementalReasoner()
+	for i, state in enumerate(growing_whole(30), 1):
+		values = reasoner.update(state)
+		assert values[x0] == i * (i + 1) // 2 and values[y] == values[x0] - 1 and values[z5] == 8
+		# after the first state, only the whole, whose equation got a part, and y, which was solved with it, are
+		# solved again
+		assert reasoner.propagator.budget.solve_calls == (7 if i == 1 else 2)
+		fresh = DeterministicReasoner()
+		fresh.state = state
+		assert values == fresh.solve_all()
+
+
+def test_incremental_matches_solve_all_on_corpus():
+	# later states can give a value to a variable or change a quantity, which rebuilds the system
+	for path in sorted(glob.glob("output_files/data/mawps/train/*.json"))[:120]:
+		mwp = json_to_MWP(path)
+		values = IncrementalReasoner().reason_states(mwp)
+		for i, state in mwp.states.items():
+			reasoner = DeterministicReasoner()
+			reasoner.state = state
+			assert values[i] == reasoner.solve_all(), (path, i)
@@ -0,0 +1,62 @@
+import numpy as np
+
+from worldmodel.container import Container
+from worldmodel.relation import Transfer
+from worldmodel.state import State, batch_adjacency
+
+
+def chain(n):
+	"""
+	containers 1..n with a transfer from each container to the next
+	"""
+	state = State("p", "")
+	for i in range(1, n + 1):
+		state.add_container(Container(i, "tom", "apple", quantity=str(i)))
+	for i in range(1, n):
+		source, target = state.containers[i], state.containers[i + 1]
+		state.add_relation(Transfer(100 + i, source, target, "1", source.tuple, recipient="tom"))
+	return state
+
+
+def edges(adj):
+	adj = adj.tocoo()
+	return sorted(zip(adj.row.tolist(), adj.col.tolist()))
+
+
+def test_adjacency_after_remove_container():
+	state = chain(3)
+	state.remove_container(1)
+	assert sorted(state.relations) == [102]
+	assert state.id2pos == {2: 0, 3: 1}
+	state.add_container(Container(9, "tom", "apple", quantity="x"))
+	source, target = state.containers[3], state.containers[9]
+	state.add_relation(Transfer(110, source, target, "1", source.tuple, recipient="tom"))
+	assert state.id2pos == {2: 0, 3: 1, 9: 2}
+	assert edges(state.to_sparse_adjacency()) == [(0, 1), (1, 2)]
+	assert state.to_sparse_adjacency().shape == (3, 3)
+	assert state.vars == ["x"]
+
+
+def test_adjacency_after_container_deleted_directly():
+	# the lengths of id2pos and containers match again after one deletion and one addition, but 1 is stale
+	state = chain(3)
+	del state.containers[1]
+	del state.relations[101]
+	state.containers[9] = Container(9, "tom", "apple", quantity="4")
+	source, target = state.containers[3], state.containers[9]
+	state.add_relation(Transfer(110, source, target, "1", source.tuple, recipient="tom"))
+	assert edges(state.to_sparse_adjacency()) == [(0, 1), (1, 2)]
+	assert np.array_equal(state.to_adjacency(), state.to_sparse_adjacency().toarray())
+
+
+def test_batch_adjacency_after_remove_container():
+	first, second = chain(2), chain(3)
+	second.remove_container(2)
+	adj, offsets = batch_adjacency([first, second])
+	assert offsets.tolist() == [0, 2, 4]
+	assert edges(adj) == [(0, 1)]
+	third = chain(3)
+	third.remove_container(3)
+	adj, offsets = batch_adjacency([third, first])
+	assert offsets.tolist() == [0, 2, 4]
+	assert edges(adj) == [(0, 1), (2, 3)]
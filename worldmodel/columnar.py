@@ -0,0 +1,117 @@
+from worldmodel.state import CONTAINER_COLUMNS, RELATION_COLUMNS
+
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# repeated string fields are dictionary encoded, both in memory (read back as pandas categoricals) and in the files
+_category = pa.dictionary(pa.int32(), pa.string())
+_types = {"problem_id": _category, "state": pa.int32(), "id": pa.int64(), "source": pa.int64(), "target": pa.int64(),
+		  "quantity": pa.string(), "value": pa.float64(), "is_variable": pa.bool_()}
+
+CONTAINER_SCHEMA = pa.schema([(column, _types.get(column, _category)) for column in CONTAINER_COLUMNS])
+RELATION_SCHEMA = pa.schema([(column, _types.get(column, _category)) for column in RELATION_COLUMNS])
+
+
+def _dictionary_columns(schema):
+	return [field.name for field in schema if pa.types.is_dictionary(field.type)]
+
+
+def _empty_columns(columns):
+	return {column: [] for column in columns}
+
+
+def to_tables(mwps, final_only=False):
+	"""
+	return the containers and relations of the given parsed MWPs as two pyarrow tables, see State.to_columns
+	use table.to_pandas() for data frames
+	"""
+	containers, relations = _empty_columns(CONTAINER_COLUMNS), _empty_columns(RELATION_COLUMNS)
+	for mwp in mwps:
+		mwp.to_columns(final_only, containers, relations)
+	return pa.Table.from_pydict(containers, CONTAINER_SCHEMA), pa.Table.from_pydict(relations, RELATION_SCHEMA)
+
+
+class ParquetExporter:
+	"""
+	streaming export of world models to two parquet files, one row per container and one row per relation
+	rows are collected per MWP and written as a row group every batch_size rows, so memory stays bounded for
+	corpora of any size; the repeated string fields use dictionary encoding
+	"""
+
+	def __init__(self, directory, final_only=False, batch_size=65536, compression="snappy"):
+		os.makedirs(directory, exist_ok=True)
+		self.final_only = final_only
+		self.batch_size = batch_size
+		self.container_path = os.path.join(directory, "containers.parquet")
+		self.relation_path = os.path.join(directory, "relations.parquet")
+		self.container_writer = pq.ParquetWriter(self.container_path, CONTAINER_SCHEMA, compression=compression,
+												 use_dictionary=_dictionary_columns(CONTAINER_SCHEMA))
+		self.relation_writer = pq.ParquetWriter(self.relation_path, RELATION_SCHEMA, compression=compression,
+												use_dictionary=_dictionary_columns(RELATION_SCHEMA))
+		self.containers = _empty_columns(CONTAINER_COLUMNS)
+		self.relations = _empty_columns(RELATION_COLUMNS)
+		self.num_containers = 0
+		self.num_relations = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def add(self, mwp):
+		mwp.to_columns(self.final_only, self.containers, self.relations)
+		if len(self.containers["id"]) >= self.batch_size:
+			self._flush_containers()
+		if len(self.relations["id"]) >= self.batch_size:
+			self._flush_relations()
+
+	def export(self, mwps):
+		"""
+		add the given parsed MWPs, return the number of problems added
+		"""
+		count = 0
+		for mwp in mwps:
+			self.add(mwp)
+			count += 1
+		return count
+
+	def _flush_containers(self):
+		if self.containers["id"]:
+			self.container_writer.write_table(pa.Table.from_pydict(self.containers, CONTAINER_SCHEMA))
+			self.num_containers += len(self.containers["id"])
+			self.containers = _empty_columns(CONTAINER_COLUMNS)
+
+	def _flush_relations(self):
+		if self.relations["id"]:
+			self.relation_writer.write_table(pa.Table.from_pydict(self.relations, RELATION_SCHEMA))
+			self.num_relations += len(self.relations["id"])
+			self.relations = _empty_columns(RELATION_COLUMNS)
+
+	def close(self):
+		"""
+		write the remaining rows and close both files
+		"""
+		self._flush_containers()
+		self._flush_relations()
+		self.container_writer.close()
+		self.relation_writer.close()
+
+
+def export_parquet(mwps, directory="worldmodels", final_only=False, batch_size=65536):
+	"""
+	write MWPs to directory/containers.parquet and directory/relations.parquet
+	returns the number of problems, containers and relations written
+	"""
+	with ParquetExporter(directory, final_only, batch_size) as exporter:
+		count = exporter.export(mwps)
+	return count, exporter.num_containers, exporter.num_relations
+
+
+def read_parquet(directory="worldmodels"):
+	"""
+	read the tables written by export_parquet back as two pandas data frames (containers, relations)
+	"""
+	return pq.read_table(os.path.join(directory, "containers.parquet")).to_pandas(), \
+		pq.read_table(os.path.join(directory, "relations.parquet")).to_pandas()
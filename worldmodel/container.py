@@ -96,6 +96,17 @@ class Container:
 		out["unit"] = self.tuple.unit
 		return out
 
+	def to_node(self):
+		"""
+		node in the annotation json format, see loader.json_to_MWP
+		a quantity that was a variable before its value was set keeps the variable name under "variable"
+		"""
+		metadata = {"entity": self.tuple.entity, "quantity": str(self.quantity), "unit": _empty(self.tuple.unit),
+					"attribute": _empty(self.tuple.attribute), "reference": ""}
+		if self.quantity.is_known() and self.quantity.var is not None:
+			metadata["variable"] = str(self.quantity.var)
+		return {"label": self.label, "metadata": metadata}
+
 	def set_value(self, number):
 		"""
 		Sets the quantity to an explicit number
@@ -129,3 +140,10 @@ class Container:
 			return self.label == other.label and self.tuple == other.tuple
 		else:
 			return self.label == other.label and self.tuple.entity == other.tuple.entity
+
+
+def _empty(value):
+	"""
+	optional arguments left without value are empty strings in the annotation json format
+	"""
+	return "" if value is None else value
@@ -0,0 +1,238 @@
+from worldmodel.loader import data_to_MWP, parse_into_state
+from worldmodel.state import RELATION_TUPLES
+
+import json
+import sqlite3
+
+# the tuple columns of relations, one per tuple attribute of the relation classes (see state.RELATION_TUPLES); each is
+# flattened into <prefix>entity, <prefix>attribute, <prefix>unit in the views
+TUPLE_COLUMNS = {attribute: prefix + "tuple_id" for attribute, prefix in RELATION_TUPLES.items()}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS problems (id TEXT PRIMARY KEY, body TEXT, question TEXT, num_states INTEGER,
+	answer TEXT, metadata TEXT);
+CREATE TABLE IF NOT EXISTS states (problem_id TEXT, position INTEGER, final INTEGER, span TEXT, ref TEXT,
+	answer TEXT, graph TEXT, PRIMARY KEY (problem_id, position));
+CREATE TABLE IF NOT EXISTS tuples (id INTEGER PRIMARY KEY, entity TEXT, attribute TEXT, unit TEXT,
+	UNIQUE (entity, attribute, unit));
+CREATE TABLE IF NOT EXISTS containers (problem_id TEXT, position INTEGER, final INTEGER, id INTEGER, label TEXT,
+	quantity TEXT, known INTEGER, tuple_id INTEGER REFERENCES tuples (id), PRIMARY KEY (problem_id, position, id));
+CREATE TABLE IF NOT EXISTS relations (problem_id TEXT, position INTEGER, final INTEGER, id INTEGER, type TEXT,
+	source INTEGER, target INTEGER, quantity TEXT, known INTEGER, recipient TEXT, sender TEXT, result TEXT,
+	argument TEXT, {tuple_columns}, PRIMARY KEY (problem_id, position, id));
+CREATE INDEX IF NOT EXISTS containers_label ON containers (label, final);
+CREATE INDEX IF NOT EXISTS containers_tuple ON containers (tuple_id, final);
+CREATE INDEX IF NOT EXISTS relations_type ON relations (type, final);
+{tuple_indexes}
+CREATE INDEX IF NOT EXISTS tuples_entity ON tuples (entity);
+CREATE INDEX IF NOT EXISTS tuples_unit ON tuples (unit);
+CREATE INDEX IF NOT EXISTS tuples_attribute ON tuples (attribute);
+""".format(
+	tuple_columns=", ".join(f"{column} INTEGER" for column in TUPLE_COLUMNS.values()),
+	tuple_indexes="\n".join(f"CREATE INDEX IF NOT EXISTS relations_{column[:-3]} ON relations ({column});"
+							for column in TUPLE_COLUMNS.values()))
+
+VIEWS = """
+CREATE VIEW IF NOT EXISTS container_view AS SELECT c.problem_id, c.position, c.final, c.id, c.label, c.quantity,
+	c.known, t.entity, t.attribute, t.unit FROM containers c JOIN tuples t ON c.tuple_id = t.id;
+CREATE VIEW IF NOT EXISTS relation_view AS SELECT r.problem_id, r.position, r.final, r.id, r.type, r.source, r.target,
+	r.quantity, r.known, r.recipient, r.sender, r.result, r.argument, {columns} FROM relations r {joins};
+""".format(
+	columns=", ".join(f"{alias}.{field} AS {prefix}{field}" for alias, prefix in
+					  [(f"t{i}", prefix) for i, prefix in enumerate(RELATION_TUPLES.values())]
+					  for field in ["entity", "attribute", "unit"]),
+	joins=" ".join(f"LEFT JOIN tuples t{i} ON r.{column} = t{i}.id" for i, column in enumerate(TUPLE_COLUMNS.values())))
+
+
+class WorldModelDatabase:
+	"""
+	relational export of world models to an indexed sqlite file, for queries over the whole corpus
+	every state of every problem is stored: containers and relations get one row per state they occur in (with the
+	position of the state and whether it is the final one), entity tuples are stored once and referenced by id,
+	and each state also keeps its annotation graph (see State.to_graph) so that it can be rehydrated exactly
+	queries go through the views container_view and relation_view, in which the tuples are flattened into columns
+	entity, attribute, unit (and num_/den_/res_/arg_ prefixed for rates and explicit relations)
+	"""
+
+	def __init__(self, path="worldmodels.sqlite"):
+		self.path = path
+		self.connection = sqlite3.connect(path)
+		self.connection.executescript(SCHEMA + VIEWS)
+		self.connection.commit()
+		self.tuple_ids = {tuple(row[1:]): row[0] for row in
+						  self.connection.execute("SELECT id, entity, attribute, unit FROM tuples")}
+		self.container_columns = self._columns("container_view")
+		self.relation_columns = self._columns("relation_view")
+
+	def _columns(self, view):
+		return [row[1] for row in self.connection.execute(f"PRAGMA table_info({view})")]
+
+	def close(self):
+		self.connection.close()
+
+	def __len__(self):
+		return self.connection.execute("SELECT COUNT(*) FROM problems").fetchone()[0]
+
+	def tuple_id(self, tuple):
+		"""
+		return the id of an entity tuple, inserting it if needed
+		"""
+		if tuple is None:
+			return None
+		key = tuple.get_tuple()
+		if key not in self.tuple_ids:
+			cursor = self.connection.execute("INSERT INTO tuples (entity, attribute, unit) VALUES (?, ?, ?)", key)
+			self.tuple_ids[key] = cursor.lastrowid
+		return self.tuple_ids[key]
+
+	def export(self, mwps, commit_every=1000, keys=None, replace=False):
+		"""
+		add the given parsed MWPs, return the number of problems written
+		keys are the ids to store the problems under, in the order of mwps (their own ids if None); ids are not unique
+		across datasets (e.g. mawps-19 is both in asdiv/train and mawps/test), so pass e.g. "dataset/split/id" keys
+		when exporting several datasets; see add for replace
+		"""
+		count = 0
+		keys = iter(keys) if keys is not None else None
+		for mwp in mwps:
+			self.add(mwp, next(keys) if keys is not None else None, replace)
+			count += 1
+			if count % commit_every == 0:
+				self.connection.commit()
+		self.connection.commit()
+		return count
+
+	def add(self, mwp, key=None, replace=False):
+		"""
+		add a parsed MWP under key (its id if None)
+		raises ValueError if a problem is already stored under that key, unless replace
+		"""
+		key = mwp.id if key is None else key
+		if self.connection.execute("SELECT 1 FROM problems WHERE id = ?", (key,)).fetchone() is not None:
+			if not replace:
+				raise ValueError(f"problem {key} is already in the database, use other keys or replace=True")
+			self.connection.execute("DELETE FROM problems WHERE id = ?", (key,))
+			for table in ["states", "containers", "relations"]:
+				self.connection.execute(f"DELETE FROM {table} WHERE problem_id = ?", (key,))
+		graphs = mwp.to_json()
+		answer = mwp.final.answer if mwp.final is not None else None
+		self.connection.execute("INSERT INTO problems VALUES (?, ?, ?, ?, ?, ?)",
+								(key, mwp.body, mwp.question, mwp.num_states, _str(answer), json.dumps(mwp.metadata)))
+		for position, graph in enumerate(graphs):
+			state = mwp.states[position]
+			final = int(position == mwp.num_states - 1)
+			self.connection.execute("INSERT INTO states VALUES (?, ?, ?, ?, ?, ?, ?)",
+									(key, position, final, state.span, _str(state.ref), _str(state.answer),
+									 json.dumps(graph)))
+			self.connection.executemany("INSERT INTO containers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+										[(key, position, final, c.id, c.label, str(c.quantity), int(c.is_known()),
+										  self.tuple_id(c.tuple)) for c in state.containers.values()])
+			self.connection.executemany("INSERT INTO relations VALUES (" + ", ".join(["?"] * (13 + len(TUPLE_COLUMNS))) + ")",
+										[self._relation_row(key, position, final, r)
+										 for r in state.relations.values()])
+
+	def _relation_row(self, problem_id, position, final, r):
+		quantity, known = (None, None) if r.type == "part-whole" else (str(r.quantity), int(r.is_known()))
+		return (problem_id, position, final, r.id, r.type, r.source.id, r.target.id, quantity, known,
+				getattr(r, "recipient", None), getattr(r, "sender", None), getattr(r, "result", None),
+				getattr(r, "argument", None)) + tuple(self.tuple_id(getattr(r, attribute, None)) for attribute in TUPLE_COLUMNS)
+
+	def query(self, sql, parameters=()):
+		"""
+		run a raw sql query and return all rows
+		"""
+		return self.connection.execute(sql, parameters).fetchall()
+
+	def _where(self, columns, conditions, final):
+		"""
+		sql condition and parameters for column = value conditions; a None value matches NULL
+		"""
+		clauses, parameters = [], []
+		for column, value in conditions.items():
+			if column not in columns:
+				raise ValueError(f"unknown column {column}, must be one of {columns}")
+			if value is None:
+				clauses.append(f"{column} IS NULL")
+			else:
+				clauses.append(f"{column} = ?")
+				parameters.append(value)
+		if final is not None:
+			clauses.append("final = ?")
+			parameters.append(int(final))
+		return " AND ".join(clauses) if clauses else "1", parameters
+
+	def find_relations(self, final=True, **conditions):
+		"""
+		return (problem id, state position, relation id) of the relations matching all column = value conditions
+		e.g. find_relations(type="rate", den_unit="hour") for all rate relations whose denominator unit is hour
+		by default only relations in final states are searched, use final=None for all states
+		"""
+		where, parameters = self._where(self.relation_columns, conditions, final)
+		return self.query(f"SELECT problem_id, position, id FROM relation_view WHERE {where} "
+						  f"ORDER BY problem_id, position, id", parameters)
+
+	def find_containers(self, final=True, **conditions):
+		"""
+		return (problem id, state position, container id) of the containers matching all column = value conditions
+		"""
+		where, parameters = self._where(self.container_columns, conditions, final)
+		return self.query(f"SELECT problem_id, position, id FROM container_view WHERE {where} "
+						  f"ORDER BY problem_id, position, id", parameters)
+
+	def problems_with_relations(self, min_count=1, max_count=None, **conditions):
+		"""
+		return the ids of problems whose final state has between min_count and max_count relations matching the
+		conditions, e.g. problems_with_relations(min_count=4, type="part-whole")
+		"""
+		where, parameters = self._where(self.relation_columns, conditions, True)
+		having = "COUNT(*) >= ?" + ("" if max_count is None else " AND COUNT(*) <= ?")
+		parameters += [min_count] + ([] if max_count is None else [max_count])
+		return [row[0] for row in self.query(f"SELECT problem_id FROM relation_view WHERE {where} "
+											 f"GROUP BY problem_id HAVING {having} ORDER BY problem_id", parameters)]
+
+	def problem_ids(self):
+		return [row[0] for row in self.query("SELECT id FROM problems ORDER BY id")]
+
+	def state(self, problem_id, position=None):
+		"""
+		rehydrate the state at position (the final state by default) of a problem
+		"""
+		if position is None:
+			row = self.connection.execute("SELECT graph FROM states WHERE problem_id = ? AND final = 1",
+										  (problem_id,)).fetchone()
+		else:
+			row = self.connection.execute("SELECT graph FROM states WHERE problem_id = ? AND position = ?",
+										  (problem_id, position)).fetchone()
+		if row is None:
+			raise KeyError(f"no state for {problem_id} at position {position}")
+		return parse_into_state(json.loads(row[0]))
+
+	def states(self, rows):
+		"""
+		rehydrate the states of (problem id, position, ...) rows as returned by find_relations or find_containers,
+		or the final states of a list of problem ids; each state is rehydrated once
+		"""
+		keys = dict.fromkeys((row, None) if isinstance(row, str) else tuple(row[:2]) for row in rows)
+		return [self.state(*key) for key in keys]
+
+	def mwp(self, problem_id):
+		"""
+		rehydrate the complete MWP of a problem
+		"""
+		rows = self.query("SELECT graph FROM states WHERE problem_id = ? ORDER BY position", (problem_id,))
+		if not rows:
+			raise KeyError(f"no problem {problem_id}")
+		return data_to_MWP([json.loads(row[0]) for row in rows])
+
+
+def _str(value):
+	return None if value is None else str(value)
+
+
+def export_corpus(mwps, path="worldmodels.sqlite", keys=None):
+	"""
+	write MWPs to a sqlite database at path and return it, see WorldModelDatabase.export for keys
+	"""
+	database = WorldModelDatabase(path)
+	database.export(mwps, keys=keys)
+	return database
@@ -0,0 +1,303 @@
+from worldmodel.container import Container
+from worldmodel.relation import *
+from worldmodel.state import State
+from worldmodel.mwp import MWP
+
+import random
+
+AGENTS = ["tom", "anna", "james", "maria", "liam", "sophie", "noah", "emma", "lucas", "mia"]
+ENTITIES = ["apple", "pencil", "marble", "cookie", "book", "sticker", "flower", "coin", "shell", "card"]
+CATEGORIES = ["fruit", "thing", "item", "object", "supply", "toy", "gift", "treat", "collection", "good"]
+
+# relative frequencies of the relation types, roughly those of the annotated data
+RELATION_MIX = {"transfer": 0.35, "rate": 0.2, "part-whole": 0.15, "difference": 0.15, "explicit": 0.15}
+
+
+def _letters(i):
+	"""
+	the i-th string over a-z (a, b, ..., z, ba, bb, ...), names in logical forms may not contain digits
+	"""
+	out = ""
+	while True:
+		out = chr(ord("a") + i % 26) + out
+		i //= 26
+		if i == 0:
+			return out
+
+
+def _name(pool, i):
+	"""
+	the i-th name from pool, suffixed with letters once the pool is used up
+	"""
+	return pool[i % len(pool)] + ("" if i < len(pool) else _letters(i // len(pool)))
+
+
+class _Draft:
+	# the problem under construction
+
+	def __init__(self, problem_id):
+		self.id = problem_id
+		self.state = State(problem_id=problem_id, span="")
+		self.states = []
+		self.spans = []
+		self.lins = []
+		# true value of every container id
+		self.values = {}
+		self.next_id = 1
+		self.next_var = 1
+		self.counts = {"agent": 0, "entity": 0, "category": 0}
+		# tip of the current chain, its length, and the tips of finished chains
+		self.tip = None
+		self.length = 0
+		self.tips = []
+		# containers, relations and sentences added in the current span
+		self.added = []
+		self.text = []
+
+	def fresh(self, kind):
+		pool = {"agent": AGENTS, "entity": ENTITIES, "category": CATEGORIES}[kind]
+		name = _name(pool, self.counts[kind])
+		self.counts[kind] += 1
+		return name
+
+	def container(self, label, entity, value, known=True):
+		quantity = value if known else f"x{self.next_var}"
+		if not known:
+			self.next_var += 1
+		container = Container(self.next_id, label=label, entity=entity, quantity=quantity)
+		self.next_id += 1
+		self.values[container.id] = value
+		self.state.add_container(container)
+		self.added.append(container)
+		return container
+
+	def relation(self, relation):
+		self.next_id += 1
+		self.state.add_relation(relation)
+		self.added.append(relation)
+		return relation
+
+
+class WorldModelGenerator:
+	"""
+	seeded generator of valid MWP objects of arbitrary size, for stress and scaling tests
+	a problem is a sequence of chains: each chain starts from a known container and is extended by one relation
+	per step (with the new container as the next tip) until it reaches depth relations, after which a new chain is
+	started. part-whole steps merge the current tip with the tips of finished chains (or new known containers)
+	depth: maximum number of relations in a chain
+	relation_mix: dict from relation type (see RELATION_TYPES) to relative frequency
+	unknown: fraction of derived containers whose quantity is a variable, the question container is always unknown
+	relations_per_span: number of relations per sentence; every span gets a state, so large problems
+	should use several relations per span to keep the number of states (each a copy of the previous) manageable
+	quantities are integers and all systems are consistent and determined, with the answer set in the last state
+	"""
+
+	def __init__(self, seed=0, depth=8, relation_mix=None, unknown=0.5, max_parts=4, relations_per_span=1,
+				 max_value=10**6):
+		relation_mix = RELATION_MIX if relation_mix is None else relation_mix
+		if not set(relation_mix).issubset(RELATION_TYPES):
+			raise ValueError(f"relation types must be in {RELATION_TYPES}")
+		if not 0 <= unknown <= 1:
+			raise ValueError("unknown must be between 0 and 1")
+		if depth < 1 or max_parts < 2 or relations_per_span < 1:
+			raise ValueError("depth and relations_per_span must be positive, max_parts at least 2")
+		self.random = random.Random(seed)
+		self.depth = depth
+		self.types = list(relation_mix.keys())
+		self.weights = list(relation_mix.values())
+		self.unknown = unknown
+		self.max_parts = max_parts
+		self.relations_per_span = relations_per_span
+		self.max_value = max_value
+
+	def generate(self, size, problem_id=None):
+		"""
+		return an MWP with size relations
+		"""
+		return self.to_mwp(self.build(size, problem_id))
+
+	def generate_with_linearizations(self, size, problem_id=None):
+		"""
+		return an MWP with size relations and the linearization of each of its spans
+		linearizations follow the training format of MWP.compute_diff, without its quadratic cost
+		"""
+		draft = self.build(size, problem_id)
+		return self.to_mwp(draft), draft.lins
+
+	def build(self, size, problem_id=None):
+		if size < 1:
+			raise ValueError("size must be positive")
+		draft = _Draft(problem_id if problem_id is not None else f"synthetic-{size}")
+		for step in range(size):
+			last = step == size - 1
+			self.step(draft, last)
+			if last or (step + 1) % self.relations_per_span == 0:
+				self.close_span(draft, last)
+		return draft
+
+	def step(self, draft, last):
+		"""
+		add one relation (and its containers) to the draft
+		"""
+		if draft.tip is None or draft.length >= self.depth:
+			if draft.tip is not None:
+				draft.tips.append(draft.tip)
+			label, entity, value = draft.fresh("agent"), draft.fresh("entity"), self.random.randint(1, 20)
+			draft.tip = draft.container(label, entity, value)
+			draft.text.append(f"{label.capitalize()} has {value} {entity}s.")
+			draft.length = 0
+
+		type = self.random.choices(self.types, self.weights)[0]
+		known = not last and self.random.random() >= self.unknown
+		{"transfer": self.transfer, "rate": self.rate, "part-whole": self.part_whole,
+		 "difference": self.explicit_add, "explicit": self.explicit_times}[type](draft, known)
+		draft.length += 1
+
+		if last:
+			tip = draft.tip
+			draft.text.append(f"How many {tip.tuple.entity}s does {tip.label} have?")
+		elif known:
+			draft.text.append(f"{draft.tip.label.capitalize()} has {draft.tip.get_value()} {draft.tip.tuple.entity}s now.")
+
+	def transfer(self, draft, known):
+		tip = draft.tip
+		value = draft.values[tip.id]
+		amount = self.random.randint(1, 10)
+		receive = amount > value or self.random.random() < 0.5
+		new_value = value + amount if receive else value - amount
+		if new_value > self.max_value:
+			receive, new_value = False, value - min(amount, value)
+			amount = value - new_value
+		new = draft.container(tip.label, tip.tuple.entity, new_value, known)
+		if receive:
+			relation = Transfer(draft.next_id, tip, new, amount, tip.tuple, recipient=tip.label)
+			draft.text.append(f"{tip.label.capitalize()} gets {amount} more {tip.tuple.entity}s.")
+		else:
+			relation = Transfer(draft.next_id, tip, new, amount, tip.tuple, sender=tip.label)
+			draft.text.append(f"{tip.label.capitalize()} gives away {amount} {tip.tuple.entity}s.")
+		draft.relation(relation)
+		draft.tip = new
+
+	def rate(self, draft, known):
+		# the tip is the denominator: source (new) = target (tip) * rate
+		tip = draft.tip
+		amount = self.random.randint(2, 5)
+		new_value = draft.values[tip.id] * amount
+		if new_value > self.max_value:
+			return self.transfer(draft, known)
+		new = draft.container(tip.label, draft.fresh("entity"), new_value, known)
+		draft.relation(Rate(draft.next_id, new, tip, amount, new.tuple, tip.tuple))
+		draft.text.append(f"Each {tip.tuple.entity} has {amount} {new.tuple.entity}s.")
+		draft.tip = new
+
+	def explicit_add(self, draft, known):
+		tip = draft.tip
+		amount = self.random.randint(1, 10)
+		new = draft.container(draft.fresh("agent"), tip.tuple.entity, draft.values[tip.id] + amount, known)
+		draft.relation(ExplicitAdd(draft.next_id, tip, new, amount, new.tuple, tip.tuple, result=new.label,
+								   argument=tip.label))
+		draft.text.append(f"{new.label.capitalize()} has {amount} more {tip.tuple.entity}s than {tip.label}.")
+		draft.tip = new
+
+	def explicit_times(self, draft, known):
+		tip = draft.tip
+		amount = self.random.randint(2, 4)
+		new_value = draft.values[tip.id] * amount
+		if new_value > self.max_value:
+			return self.explicit_add(draft, known)
+		new = draft.container(draft.fresh("agent"), tip.tuple.entity, new_value, known)
+		draft.relation(ExplicitTimes(draft.next_id, tip, new, amount, new.tuple, tip.tuple, result=new.label,
+									 argument=tip.label))
+		draft.text.append(f"{new.label.capitalize()} has {amount} times as many {tip.tuple.entity}s as {tip.label}.")
+		draft.tip = new
+
+	def part_whole(self, draft, known):
+		tip = draft.tip
+		parts = [tip]
+		num_parts = self.random.randint(2, self.max_parts)
+		while len(parts) < num_parts and draft.tips:
+			parts.append(draft.tips.pop())
+		while len(parts) < num_parts:
+			value = self.random.randint(1, 20)
+			parts.append(draft.container(tip.label, draft.fresh("entity"), value))
+			draft.text.append(f"{tip.label.capitalize()} also has {value} {parts[-1].tuple.entity}s.")
+		total = sum(draft.values[part.id] for part in parts)
+		if total > self.max_value:
+			draft.tips += parts[1:]
+			return self.transfer(draft, known)
+		whole = draft.container(tip.label, draft.fresh("category"), total, known)
+		for part in parts:
+			draft.relation(PartWhole(draft.next_id, part, whole))
+		draft.text.append(f"The {', '.join(part.tuple.entity + 's' for part in parts)} are all {whole.tuple.entity}s.")
+		draft.tip = whole
+
+	def close_span(self, draft, last):
+		"""
+		turn the containers and relations added since the previous span into a state and its linearization
+		"""
+		span = " ".join(draft.text)
+		draft.state.span = span
+		if last:
+			draft.state.set_ref(draft.tip.get_value())
+			draft.state.set_answer(draft.values[draft.tip.id])
+		draft.lins.append(self.linearize(draft.added, draft.tip if last else None))
+		draft.states.append(draft.state)
+		draft.spans.append(span)
+
+		# the next state starts as a copy of this one; containers and relations are not modified and can be shared
+		draft.state = draft.state.copy(span="")
+		draft.added = []
+		draft.text = []
+
+	@staticmethod
+	def linearize(added, ref_holder=None):
+		"""
+		linearization of the containers and relations added in one span, in the training format of compute_diff
+		variable containers are left out if the span adds a relation other than part-whole, and the part-wholes
+		of a span are linearized in conjunction
+		unlike compute_diff, objects equal to ones added in earlier spans are kept, and the conjoined part-whole form
+		(the one update_world_model parses) is also used for the first span
+		"""
+		relations = [x for x in added if isinstance(x, Relation)]
+		part_whole = any(r.type == "part-whole" for r in relations)
+		out = []
+		for x in added:
+			if isinstance(x, Container):
+				if not (relations and x.is_variable() and not part_whole):
+					out.append(str(x))
+			elif x.type != "part-whole":
+				out.append(str(x))
+		if part_whole:
+			wholes = []
+			for r in relations:
+				if r.type == "part-whole" and r.target not in wholes:
+					wholes.append(r.target)
+			for whole in wholes:
+				lin = f"part ( {whole.label} , {whole.tuple.entity} , {whole.tuple.attribute} , {whole.tuple.unit} "
+				for r in relations:
+					if r.type == "part-whole" and r.target is whole:
+						part = r.get_part()
+						lin += f", {part.label} , {part.tuple.entity} , {part.tuple.attribute} , {part.tuple.unit} "
+				out.append(lin + ")")
+		if ref_holder is not None and str(ref_holder) not in out:
+			out.append(str(ref_holder))
+		return " ".join(out)
+
+	def to_mwp(self, draft):
+		body = " ".join(draft.spans[:-1])
+		mwp = MWP(problem_id=draft.id, body=body, question=draft.spans[-1], spans=list(draft.spans),
+				  answer=draft.values[draft.tip.id])
+		for state in draft.states:
+			mwp.add_state(state)
+		return mwp
+
+
+def generate_corpus(num_problems, size, seed=0, **kwargs):
+	"""
+	yield num_problems (mwp, linearizations) pairs of the given size (int, or (min, max) for a random size)
+	keyword arguments are passed on to WorldModelGenerator
+	"""
+	generator = WorldModelGenerator(seed=seed, **kwargs)
+	for i in range(num_problems):
+		n = size if isinstance(size, int) else generator.random.randint(*size)
+		yield generator.generate_with_linearizations(n, problem_id=f"synthetic-{seed}-{i}")
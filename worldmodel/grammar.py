@@ -0,0 +1,206 @@
+from worldmodel.loader import update_world_model, problem_vocab as text_vocab
+
+import bisect
+import re
+
+# argument slots of the logical forms, following the __str__ methods of Container and each Relation
+# T: one or more words (labels, entities, attributes, units, none), N: a single number or none
+FORMS = {
+	"container": "TNTTT",  # container(label, quantity, entity, attribute, unit)
+	"transfer": "TTNTTT",  # transfer(recipient, sender, quantity, entity, attribute, unit)
+	"rate": "TNTTTTTT",  # rate(label, quantity, num_entity, num_attribute, num_unit, den_entity, den_attribute, den_unit)
+	"part": "T" * 24,  # part(whole_label, part_label, whole tuple, part tuple), each further part adds 4 arguments
+	"difference": "TTNTTTTTT",  # explicit-add(result, argument, quantity, res tuple, arg tuple)
+	"explicit": "TTNTTTTTT",  # explicit-times(result, argument, quantity, res tuple, arg tuple)
+}
+# part-whole forms have one to five parts
+PART_LENGTHS = (8, 12, 16, 20, 24)
+
+# markers for the open token classes and the end of a linearization in the sets returned by allowed()
+WORD = "<word>"
+NUMBER = "<number>"
+END = "<end>"
+
+_word = re.compile("[a-z.']+")
+_word_prefix = re.compile("[a-z.']*")
+_number = re.compile("[0-9]*[./]?[0-9]*")
+
+# decoding phases
+_BETWEEN, _OPEN, _SLOT = 0, 1, 2
+
+
+def problem_vocab(mwp):
+	"""
+	the words allowed in the arguments of logical forms for mwp, as with update_world_model(enforce_vocab=True):
+	the tokens of the problem text, their lemmas and the special tokens (see loader.problem_vocab)
+	"""
+	return frozenset(word for word in text_vocab(mwp) if _word.fullmatch(word))
+
+
+class LinearizationGrammar:
+	"""
+	incremental state machine over the space separated tokens of a linearization (see keep_well_formed)
+	allowed() gives the set of tokens that can come next, advance(token) consumes one; a linearization is complete
+	when END is allowed, i.e. between logical forms
+	with a vocab (e.g. problem_vocab(mwp)) words in arguments are restricted to it, otherwise any [a-z.']+ word is
+	allowed, which is marked by WORD in allowed(); numbers are always open and marked by NUMBER
+	"""
+
+	def __init__(self, vocab = None):
+		self.vocab = frozenset(vocab) if vocab is not None else None
+		self._sorted_vocab = sorted(self.vocab) if self.vocab is not None else None
+		words = self.vocab if self.vocab is not None else frozenset([WORD])
+		# allowed sets per (words already in the slot, may continue with a comma, may close), built once
+		self._text = {(False, comma, close): words for comma in [False, True] for close in [False, True]}
+		self._text.update({(True, comma, close): words | ({","} if comma else set()) | ({")"} if close else set())
+						   for comma in [False, True] for close in [False, True]})
+		self._between_end = frozenset(FORMS) | {END}
+		self.reset()
+
+	def reset(self):
+		"""
+		go back to the start of a linearization
+		"""
+		self.phase = _BETWEEN
+		self.form = None
+		self.slot = 0
+		self.words = 0
+		self.tokens = []
+
+	def copy(self):
+		"""
+		independent copy of the current decoding state, e.g. for beam search
+		"""
+		other = object.__new__(LinearizationGrammar)
+		other.__dict__.update(self.__dict__)
+		other.tokens = list(self.tokens)
+		return other
+
+	def _can_close(self):
+		if self.form == "part":
+			return self.slot + 1 in PART_LENGTHS
+		return self.slot + 1 == len(FORMS[self.form])
+
+	def _has_next(self):
+		return self.slot + 1 < len(FORMS[self.form])
+
+	def _kind(self):
+		return FORMS[self.form][self.slot]
+
+	def is_complete(self):
+		"""
+		true if the tokens so far form a (possibly empty) sequence of complete logical forms
+		"""
+		return self.phase == _BETWEEN
+
+	def allowed(self):
+		"""
+		the set of tokens that can come next
+		"""
+		if self.phase == _BETWEEN:
+			return self._between_end
+		if self.phase == _OPEN:
+			return frozenset(["("])
+		if self._kind() == "N":
+			if self.words == 0:
+				return frozenset([NUMBER, "none"])
+			return frozenset(([","] if self._has_next() else []) + ([")"] if self._can_close() else []))
+		return self._text[(self.words > 0, self._has_next(), self._can_close())]
+
+	def is_word(self, token):
+		if self.vocab is not None:
+			return token in self.vocab
+		return _word.fullmatch(token) is not None
+
+	@staticmethod
+	def is_number(token):
+		return _number.fullmatch(token) is not None and any(c.isdigit() for c in token)
+
+	def accepts(self, token):
+		"""
+		true if token can come next
+		"""
+		if self.phase == _BETWEEN:
+			return token in FORMS or token == END
+		if self.phase == _OPEN:
+			return token == "("
+		if token == ",":
+			return self.words > 0 and self._has_next()
+		if token == ")":
+			return self.words > 0 and self._can_close()
+		if self._kind() == "N":
+			return self.words == 0 and (token == "none" or self.is_number(token))
+		return self.is_word(token)
+
+	def accepts_prefix(self, prefix):
+		"""
+		true if some token that can come next starts with prefix, for decoders whose tokens are pieces of words
+		"""
+		if self.phase == _BETWEEN:
+			return any(token.startswith(prefix) for token in self._between_end)
+		if self.phase == _OPEN:
+			return "(".startswith(prefix)
+		if prefix == "":
+			return True
+		if prefix in [",", ")"]:
+			return self.accepts(prefix)
+		if self._kind() == "N":
+			return self.words == 0 and ("none".startswith(prefix) or _number.fullmatch(prefix) is not None)
+		if self.vocab is None:
+			return _word_prefix.fullmatch(prefix) is not None
+		i = bisect.bisect_left(self._sorted_vocab, prefix)
+		return i < len(self._sorted_vocab) and self._sorted_vocab[i].startswith(prefix)
+
+	def mask(self, candidates):
+		"""
+		list of booleans, true for the candidate tokens that can come next (e.g. over the vocabulary of a decoder)
+		"""
+		return [self.accepts(token) for token in candidates]
+
+	def advance(self, token):
+		"""
+		consume the next token, raise ValueError if it is not allowed
+		"""
+		if not self.accepts(token):
+			raise ValueError(f"token {token!r} not allowed after {' '.join(self.tokens)!r}")
+		if token == END:
+			return
+		self.tokens.append(token)
+		if self.phase == _BETWEEN:
+			self.phase, self.form = _OPEN, token
+		elif self.phase == _OPEN:
+			self.phase, self.slot, self.words = _SLOT, 0, 0
+		elif token == ",":
+			self.slot, self.words = self.slot + 1, 0
+		elif token == ")":
+			self.phase, self.form = _BETWEEN, None
+		else:
+			self.words += 1
+
+	def linearization(self):
+		"""
+		the complete logical forms consumed so far, an unfinished last one is left out
+		"""
+		end = len(self.tokens)
+		if self.phase != _BETWEEN:
+			end = max([i + 1 for i, token in enumerate(self.tokens) if token == ")"], default=0)
+		return " ".join(self.tokens[:end])
+
+
+def constrained_update(mwp, propose, enforce_vocab = True, max_tokens = 512):
+	"""
+	decode the linearization of the next span of mwp token by token and apply it with update_world_model
+	propose(tokens, grammar) gives the candidate next tokens of a decoder, best first; the first one the grammar allows
+	is taken, END stops decoding; decoding also stops when no candidate is allowed or after max_tokens tokens, and an
+	unfinished last logical form is then dropped
+	returns the linearization that was applied
+	"""
+	grammar = LinearizationGrammar(problem_vocab(mwp) if enforce_vocab else None)
+	for _ in range(max_tokens):
+		token = next((t for t in propose(list(grammar.tokens), grammar) if grammar.accepts(t)), None)
+		if token is None or token == END:
+			break
+		grammar.advance(token)
+	lin = grammar.linearization()
+	update_world_model(mwp, lin)
+	return lin
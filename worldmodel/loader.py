@@ -2,30 +2,111 @@ from worldmodel.mwp import MWP
 from worldmodel.state import State
 from worldmodel.relation import *
 from worldmodel.tuple import EntityTuple
+from worldmodel import profiling
 
 import json
+import os
+import pickle
 import re
 from nltk import tokenize
 from nltk import WordNetLemmatizer
 import copy
+import functools
+from multiprocessing import Pool
+from sympy import symbols
 
 wnl = WordNetLemmatizer()
 
-def update_world_model(mwp, lin, enforce_vocab = False):
+# tokens allowed in the arguments of logical forms besides the problem vocabulary
+SPECIAL_TOKENS = ["none", "world", "money", "time", "occasion"]
+
+class UpdateStatus:
+	"""
+	outcome of one update_world_model call, see update_world_models
+	"""
+
+	def __init__(self, problem_id, lin):
+		self.problem_id = problem_id
+		# the linearization as given and its well-formed part, which was applied
+		self.lin = lin
+		self.kept = None
+		# number of logical forms in kept
+		self.forms = 0
+		# (index in kept, message) of the logical forms that were semantically ill-formed and skipped
+		self.errors = []
+		# set if the update failed as a whole, no state was added then
+		self.exception = None
+
+	def __repr__(self):
+		return f"UpdateStatus({self.problem_id}, forms={self.forms}, errors={len(self.errors)}, " \
+			   f"exception={self.exception!r})"
+
+	@property
+	def added(self):
+		return self.exception is None
+
+	@property
+	def ok(self):
+		return self.exception is None and not self.errors
+
+	def to_dict(self):
+		return {"problem_id": self.problem_id, "lin": self.lin, "kept": self.kept, "forms": self.forms,
+				"errors": [list(error) for error in self.errors],
+				"exception": None if self.exception is None else repr(self.exception)}
+
+def _ill_formed(status, i, message):
+	if status is None:
+		print(message)
+	else:
+		status.errors.append((i, message))
+
+@functools.lru_cache(maxsize=None)
+def lemmatize(word):
+	"""
+	memoized WordNet lemma of word
+	"""
+	return wnl.lemmatize(word)
+
+def expand_vocab(words):
+	"""
+	frozenset of words, their lemmas and the special tokens, the vocabulary allowed in logical forms with enforce_vocab
+	well_formed_pattern takes a frozenset as expanded already
+	"""
+	return frozenset(words).union([lemmatize(word) for word in words], SPECIAL_TOKENS)
+
+def problem_vocab(mwp):
+	"""
+	vocabulary of the body and question of mwp (see expand_vocab), tokenized once and cached on mwp.vocab
+	"""
+	if getattr(mwp, "vocab", None) is None:
+		mwp.vocab = expand_vocab(tokenize.word_tokenize((mwp.body + " " + mwp.question).lower()))
+	return mwp.vocab
+
+@functools.lru_cache(maxsize=4096)
+def _filter_pattern(vocab = None):
+	"""
+	compiled well-formedness filter of keep_well_formed for a problem vocabulary (no vocabulary if None)
+	cached, so that it is compiled once over all updates of a problem
+	"""
+	return well_formed_pattern(vocab)
+
+@profiling.timed("update_world_model")
+def update_world_model(mwp, lin, enforce_vocab = False, status = None):
 	"""
 	update an existing mwp object with a linearization lin of next sentence (after current state of mwp)
 	linearization can be incomplete or not well-formed
 	this only needs to be done at inference time
 	updates mwp inplace
+	ill-formed logical forms are reported on stdout, or recorded in status (an UpdateStatus) if given
 	"""
 
-	vocab = tokenize.word_tokenize((mwp.body + " " + mwp.question).lower())
+	started = profiling.start()
 
 	# keep only the well-formed parts
-	if enforce_vocab:
-		lin = keep_well_formed(lin, vocab)
-	else:
-		lin = keep_well_formed(lin)
+	lin = keep_well_formed(lin, pattern=_filter_pattern(problem_vocab(mwp) if enforce_vocab else None))
+	if status is not None:
+		status.kept = lin
+	profiling.stop("update_world_model.filter", started)
 
 	if not mwp.states: # first state
 		state = State(problem_id=mwp.id, span=mwp.spans[0])
@@ -45,10 +126,16 @@ def update_world_model(mwp, lin, enforce_vocab = False):
 	next_var = 1 if len(state_vars) == 0 else max([int(i) for i in re.findall("[0-9]+", " ".join(state_vars))]) + 1
 
 	# split in container/relation units
+	started = profiling.start()
 	temp = lin.split(" ")
 	left_indices = [i for i, e in enumerate(temp) if e == "("]
 	linl = [" ".join(temp[left_indices[i] - 1:left_indices[i + 1] - 1]) for i in range(len(left_indices) - 1)]
 	linl += [" ".join(temp[left_indices[-1] - 1:])]
+	if status is not None:
+		status.forms = len(linl)
+	profiling.stop("update_world_model.parse", started)
+
+	started = profiling.start()
 
 	for i, lform in enumerate(linl):
 
@@ -386,11 +473,11 @@ def update_world_model(mwp, lin, enforce_vocab = False):
 						next_var += 1
 
 		except TypeError:
-			print("TypeError: Semantic ill-formedness")
+			_ill_formed(status, i, "TypeError: Semantic ill-formedness")
 		except ValueError:
-			print("ValueError: Semantic ill-formedness")
+			_ill_formed(status, i, "ValueError: Semantic ill-formedness")
 		except:
-			print("Unknown error")
+			_ill_formed(status, i, "Unknown error")
 
 	if state.ref is None and len(mwp.states) == len(mwp.spans) - 1: # does not have a reference, which should indicate that the last lform was part-whole
 		# set ref to last container that was added (which should be unknown part or whole container in the question) that has a variable
@@ -405,9 +492,57 @@ def update_world_model(mwp, lin, enforce_vocab = False):
 				ref = r_ref[0].quantity.get_value()
 				state.set_ref(ref)
 
-
+	profiling.stop("update_world_model.graph_update", started)
 	mwp.add_state(state)
 
+def update_world_models(pairs, enforce_vocab = False, processes = 1):
+	"""
+	batched update_world_model over a list of (mwp, lin) pairs, e.g. sentence k of many problems decoded at once
+	the filter of each problem (its tokenized vocabulary with enforce_vocab) is compiled once and cached over calls
+	returns one UpdateStatus per pair, in order; a pair whose update fails (e.g. all states were already added) gets
+	the exception in its status and leaves its mwp unchanged, the other pairs are still applied
+	with processes other than 1 the problems are updated in a multiprocessing pool (all cpus if None); several pairs
+	of the same mwp are always applied in order by the same worker
+	"""
+	groups = {}
+	for index, (mwp, lin) in enumerate(pairs):
+		groups.setdefault(id(mwp), (mwp, []))[1].append((index, lin))
+	statuses = [None] * len(pairs)
+
+	if processes == 1:
+		for mwp, items in groups.values():
+			for index, status in zip([index for index, _ in items], _update_group(mwp, items, enforce_vocab)):
+				statuses[index] = status
+		return statuses
+
+	with Pool(processes) as pool:
+		results = pool.starmap(_update_remote, [(mwp, items, enforce_vocab) for mwp, items in groups.values()])
+	for (mwp, items), (states, group_statuses) in zip(groups.values(), results):
+		for state in states:
+			mwp.add_state(state)
+		for (index, _), status in zip(items, group_statuses):
+			statuses[index] = status
+	return statuses
+
+def _update_group(mwp, items, enforce_vocab):
+	statuses = []
+	for _, lin in items:
+		status = UpdateStatus(mwp.id, lin)
+		try:
+			update_world_model(mwp, lin, enforce_vocab, status)
+		except Exception as e:
+			status.exception = e
+		statuses.append(status)
+	return statuses
+
+def _update_remote(mwp, items, enforce_vocab):
+	"""
+	apply the updates to a copy of mwp in a worker process, return the new states and the statuses
+	"""
+	first = len(mwp.states)
+	statuses = _update_group(mwp, items, enforce_vocab)
+	return [mwp.states[i] for i in range(first, len(mwp.states))], statuses
+
 def none_format(s):
 	return s if s not in ["none", "None"] else None
 
@@ -439,13 +574,14 @@ def set_reference(state, lform, id, var):
 				ref = ref_container.quantity.get_value()
 	return ref
 
-def keep_well_formed(lin, vocab = None):
+def keep_well_formed(lin, vocab = None, pattern = None):
 	"""
 	take a linearization lin and output only the parts that are syntactically
 	well-formed according to the linearization specification
 	(see __str__ methods for containers and relations)
 	# instead of general regular expressions can insert the vocabulary from the problem: [token1,token2,...,tokenN]
 	# plus special tokens none, time, money, world
+	a pattern compiled by well_formed_pattern can be given instead of the vocabulary, to reuse it over many calls
 	"""
 	if not isinstance(lin, str):
 		return ""
@@ -456,12 +592,27 @@ def keep_well_formed(lin, vocab = None):
 	lin = re.sub('([,!?()])', r' \1 ', lin)
 	lin = re.sub('\s{2,}', ' ', lin)
 
+	if pattern is None:
+		pattern = well_formed_pattern(vocab)
+	matched = pattern.findall(lin)
+	out = ""
+	for i in matched:
+		out += i[0] + " "
+	out = out.strip()
+	return out
+
+def well_formed_pattern(vocab = None):
+	"""
+	compiled regex matching the well-formed logical forms, used by keep_well_formed
+	a frozenset vocab is taken as already expanded (see expand_vocab and problem_vocab), other vocabularies are
+	expanded with their lemmas and the special tokens
+	"""
 	if vocab:
-		vocab += [wnl.lemmatize(word) for word in vocab]
-		special_tokens = ["none", "world", "money", "time", "occasion"]
-		vocab += special_tokens
+		if not isinstance(vocab, frozenset):
+			# the vocabulary of the caller is left unchanged
+			vocab = expand_vocab(vocab)
 		#vocab = [word for word in vocab if word.isalpha()] # remove numerics (but it removes also tokens like mrs.)
-		constr = "[(" + "|".join([str(elem) for elem in vocab]) + ")\s]+"
+		constr = "[(" + "|".join(sorted(str(elem) for elem in vocab)) + ")\s]+"
 	else:
 		constr = "[a-zA-Z\s\.']+"
 
@@ -479,15 +630,10 @@ def keep_well_formed(lin, vocab = None):
 	partwhole_form5 = ("part (" + " {x} ," * 23 + " {x} )").format(x=constr)
 	explicitadd_form = "difference ( {} , {} , {} , {} , {} , {} , {} , {} , {} )".format(constr, constr, n_constr, constr, constr, constr, constr, constr, constr)
 	explicittimes_form = "explicit ( {} , {} , {} , {} , {} , {} , {} , {} , {} )".format(constr, constr, n_constr, constr, constr, constr, constr, constr, constr)
-	matched = re.findall(
-		f"({container_form}|{transfer_form}|{rate_form}|{partwhole_form1}|{partwhole_form2}|{partwhole_form3}|{partwhole_form4}|{partwhole_form5}|{explicitadd_form}|{explicittimes_form})".replace(' ( ', ' [(] ').replace(' )', ' [)]'),
-		lin)
-	out = ""
-	for i in matched:
-		out += i[0] + " "
-	out = out.strip()
-	return out
+	return re.compile(
+		f"({container_form}|{transfer_form}|{rate_form}|{partwhole_form1}|{partwhole_form2}|{partwhole_form3}|{partwhole_form4}|{partwhole_form5}|{explicitadd_form}|{explicittimes_form})".replace(' ( ', ' [(] ').replace(' )', ' [)]'))
 
+@profiling.timed("json_to_MWP")
 def json_to_MWP(json_path):
 	"""
 	input an annotation in json format and output an MWP object
@@ -495,6 +641,12 @@ def json_to_MWP(json_path):
 
 	with open(json_path, "r") as f:
 		data = json.load(f)
+	return data_to_MWP(data)
+
+def data_to_MWP(data):
+	"""
+	output an MWP object from an annotation already loaded from json (a list of graphs, one per state)
+	"""
 
 	# initialize MWP object
 	problem_id = data[0]["graph"]["id"]
@@ -520,8 +672,99 @@ def json_to_MWP(json_path):
 	metadata.pop("text span", None)
 	mwp.add_metadata(metadata)
 
+	if mwp.solved:
+		mwp.answer = mwp.final.get_answer()
+
 	return mwp
 
+def MWP_to_json(mwp, json_path):
+	"""
+	write an MWP object to json_path in the annotation format, json_to_MWP(json_path) gives back an equal MWP
+	"""
+	with open(json_path, "w") as f:
+		_write_graphs(mwp, f)
+
+def _write_graphs(mwp, f):
+	# states are serialized and written one at a time
+	f.write("[")
+	for i, graph in enumerate(mwp.graphs()):
+		if i > 0:
+			f.write(", ")
+		json.dump(graph, f)
+	f.write("]")
+
+def _is_binary(path, binary):
+	return path.endswith((".pkl", ".pickle")) if binary is None else binary
+
+def dump_corpus(mwps, path, append = False, binary = None):
+	"""
+	stream MWP objects to path, one at a time, so that a long prediction run can be checkpointed
+	the default format has one annotation (as read by json_to_MWP) per line; binary uses a sequence of pickles and
+	is the default for .pkl/.pickle paths
+	with append, a run can be resumed: records after the last complete one (from an interrupted write) are dropped
+	and new MWPs are added at the end; use dumped_ids(path) to skip the MWPs that were already written
+	returns the number of MWPs written
+	"""
+	binary = _is_binary(path, binary)
+	if append and os.path.exists(path):
+		_truncate_incomplete(path, binary)
+	count = 0
+	with open(path, ("a" if append else "w") + ("b" if binary else ""), encoding=None if binary else "utf-8") as f:
+		for mwp in mwps:
+			if binary:
+				pickle.dump(mwp, f)
+			else:
+				_write_graphs(mwp, f)
+				f.write("\n")
+			f.flush()
+			count += 1
+	return count
+
+def _complete_records(f, binary):
+	"""
+	yield the complete records of a corpus file together with the position after them
+	"""
+	if binary:
+		while True:
+			try:
+				record = pickle.load(f)
+			except (EOFError, pickle.UnpicklingError):
+				return
+			yield record, f.tell()
+	else:
+		position = 0
+		for line in f:
+			if not line.endswith(b"\n"):
+				return
+			position += len(line)
+			yield line, position
+
+def _truncate_incomplete(path, binary):
+	end = 0
+	with open(path, "rb") as f:
+		for _, end in _complete_records(f, binary):
+			pass
+	with open(path, "r+b") as f:
+		f.truncate(end)
+
+def load_corpus(path, binary = None):
+	"""
+	yield the MWP objects written to path by dump_corpus, an incomplete last record is skipped
+	"""
+	binary = _is_binary(path, binary)
+	with open(path, "rb") as f:
+		for record, _ in _complete_records(f, binary):
+			yield record if binary else data_to_MWP(json.loads(record))
+
+def dumped_ids(path, binary = None):
+	"""
+	return the set of problem ids written to path by dump_corpus, empty if path does not exist
+	"""
+	if not os.path.exists(path):
+		return set()
+	return {mwp.id for mwp in load_corpus(path, binary)}
+
+@profiling.timed("parse_into_state")
 def parse_into_state(state_dict):
 	"""
 	parse into state based on state_dict from json
@@ -533,11 +776,16 @@ def parse_into_state(state_dict):
 	for container_id, attributes in graph["nodes"].items():
 		attributes = unpack_container(attributes)
 		if container_id == "CQ": # or attributes["reference"] is not None:
-			state.set_answer(attributes["quantity"])
-			state.set_ref(attributes["reference"])
+			# predicted world models can have a ref without an answer
+			if attributes["quantity"] is not None:
+				state.set_answer(attributes["quantity"])
+			if attributes["reference"] is not None:
+				state.set_ref(attributes["reference"])
 		else:
 			attributes.pop("reference", None)
+			variable = attributes.pop("variable", None)
 			container = Container(id=container_id, **attributes)
+			_restore_variable(container, variable)
 			state.add_container(container)
 
 	# add relations
@@ -549,6 +797,7 @@ def parse_into_state(state_dict):
 			print("Error! container undefined")
 		type = relation["relation"]
 		attributes = unpack_relation(type, relation["metadata"])
+		variable = relation["metadata"].get("variable")
 
 		if type == "transfer":
 			relation = Transfer(id=relation_id, source=source, target=target, **attributes)
@@ -559,7 +808,11 @@ def parse_into_state(state_dict):
 		elif type in ["explicit-add", "explicit-times", "difference", "explicit"]:
 			# here we adapt to the new argument structure
 
-			if attributes["result"] == attributes["argument"]: # need to take tuples from the containers
+			if "arg_tuple" in attributes: # both tuples given explicitly, see relation._explicit_metadata
+				attributes["res_tuple"] = attributes["tuple"]
+				del attributes["tuple"]
+
+			elif attributes["result"] == attributes["argument"]: # need to take tuples from the containers
 				attributes["res_tuple"] = target.tuple
 				attributes["arg_tuple"] = source.tuple
 				del attributes["tuple"]
@@ -574,10 +827,18 @@ def parse_into_state(state_dict):
 			elif type in ["explicit-times", "explicit"]:
 				relation = ExplicitTimes(id=relation_id, source=source, target=target, **attributes)
 
+		_restore_variable(relation, variable)
 		state.add_relation(relation)
 
 	return state
 
+def _restore_variable(obj, variable):
+	"""
+	a quantity that was a variable before its value was set keeps the variable name, see Container.to_node
+	"""
+	if variable is not None:
+		obj.quantity.var = symbols(variable)
+
 def unpack_container(node):
 	"""
 	prepare format for container constructor
@@ -627,5 +888,9 @@ def unpack_relation(type, edge_attributes):
 								unit=edge_attributes["X2"][2] if edge_attributes["X2"][2] not in ["-", "", " "] else None)
 		out["result"] = edge_attributes["X3"]
 		out["argument"] = edge_attributes["X4"]
+		if "X5" in edge_attributes:
+			out["arg_tuple"] = EntityTuple(entity=edge_attributes["X5"][0],
+								attribute=edge_attributes["X5"][1] if edge_attributes["X5"][1] not in ["-", "", " "] else None,
+								unit=edge_attributes["X5"][2] if edge_attributes["X5"][2] not in ["-", "", " "] else None)
 
 	return out
@@ -1,50 +1,305 @@
 from worldmodel.mwp import MWP
 from worldmodel.state import State
+from worldmodel import profiling
 import networkx as nx
-from collections import Counter
+from collections import Counter, defaultdict
+import hashlib
+import numpy as np
+from multiprocessing import Pool, cpu_count
 
+# below this number of containers/relations strongly_equal compares objects directly instead of bucketing by hash
+BUCKET_MIN_SIZE = 8
+
+@profiling.timed("metrics.strongly_equal")
 def strongly_equal(mwp1, mwp2):
 	"""
 	Returns true if mwp1 and mwp2 match exactly: containers, relations and their arguments all match
 	This function uses the fact that if two sets have the same cardinality, injection <=> surjection <=> bijection
+	Containers and relations of mwp2 are bucketed by a hash key that is equal for equal objects, so that each
+	lookup only compares against the objects in one bucket
+	"""
+	return _strongly_equal(mwp1.get_complete_state(), mwp2.get_complete_state())
+
+@profiling.timed("metrics.weakly_equal")
+def weakly_equal(mwp1, mwp2):
+	"""
+	Returns true if mwp1 and mwp2 have the same structure/topology, including the relation types
+	Cheap graph invariants (sizes, relation type histogram, degree sequence, Weisfeiler-Lehman hash) are compared
+	first, and the isomorphism check is only run if they all agree
+	"""
+	return _weakly_equal(_Invariants(mwp1.get_complete_state()), _Invariants(mwp2.get_complete_state()))
+
+@profiling.timed("metrics.strongly_equal_batch")
+def strongly_equal_batch(mwps1, mwps2):
+	"""
+	Returns a boolean array with strongly_equal(mwps1[i], mwps2[i]) for all i
 	"""
-	state1 = mwp1.get_complete_state()
-	state2 = mwp2.get_complete_state()
+	return np.array([strongly_equal(mwp1, mwp2) for mwp1, mwp2 in zip(mwps1, mwps2)], dtype=bool)
+
+@profiling.timed("metrics.weakly_equal_batch")
+def weakly_equal_batch(mwps1, mwps2):
+	"""
+	Returns a boolean array with weakly_equal(mwps1[i], mwps2[i]) for all i
+	Graph invariants are computed once per distinct MWP object, so e.g. one gold compared to many predictions is cheap
+	"""
+	cache = {}
+
+	def invariants(mwp):
+		if id(mwp) not in cache:
+			cache[id(mwp)] = (mwp, _Invariants(mwp.get_complete_state()))
+		return cache[id(mwp)][1]
+
+	return np.array([_weakly_equal(invariants(mwp1), invariants(mwp2)) for mwp1, mwp2 in zip(mwps1, mwps2)],
+					dtype=bool)
+
+def _strongly_equal(state1, state2):
 	if len(state1.containers) != len(state2.containers):
 		return False
 	if len(state1.relations) != len(state2.relations):
 		return False
 
 	# check bijection for containers
-	containers1 = state1.containers.values()
-	containers2 = state2.containers.values()
-	for container in containers1:
-		if container not in containers2:
-			return False
+	if not _all_contained(state1.containers.values(), state2.containers.values(), _container_key):
+		return False
 
 	# check bijection for relations
-	relations1 = state1.relations.values()
-	relations2 = state2.relations.values()
-	for relation in relations1:
-		if relation not in relations2:
-			return False
+	return _all_contained(state1.relations.values(), state2.relations.values(), _relation_key)
 
+def _all_contained(objects1, objects2, key):
+	"""
+	return true if every object in objects1 is equal to some object in objects2
+	small inputs are scanned directly, since computing the keys costs about as much as the comparisons saved
+	"""
+	if len(objects2) <= BUCKET_MIN_SIZE:
+		return all(obj in objects2 for obj in objects1)
+	buckets = defaultdict(list)
+	for obj in objects2:
+		buckets[key(obj)].append(obj)
+	for obj in objects1:
+		if obj not in buckets.get(key(obj), ()):
+			return False
 	return True
 
-def weakly_equal(mwp1, mwp2):
+def _quantity_key(quantity):
+	# numbers that compare equal (e.g. 2 and 2.0, Rational(1, 2) and 0.5) must get the same key
+	if quantity.num is None:
+		return quantity.var
+	return quantity.num if isinstance(quantity.num, (int, float)) else float(quantity.num)
+
+def _container_key(container):
+	return container.label, _quantity_key(container.quantity), container.tuple.get_tuple()
+
+def _relation_key(relation):
+	# relation equality compares only the structure of source and target
+	quantity = None if relation.type == "part-whole" else _quantity_key(relation.quantity)
+	return relation.type, quantity, relation.source.label, relation.source.tuple.get_tuple(), \
+		relation.target.label, relation.target.tuple.get_tuple()
+
+class _Invariants:
 	"""
-	Returns true if mwp1 and mwp2 have the same structure/topology, including the relation types
+	Undirected topology of a state together with isomorphism-invariant summaries of it
+	"""
+
+	def __init__(self, state):
+		self.graph = nx.Graph()
+		self.graph.add_nodes_from(state.containers.keys())
+		self.graph.add_edges_from((r.source.id, r.target.id) for r in state.relations.values())
+		self.types = Counter(r.type for r in state.relations.values())
+		self.degrees = sorted(d for _, d in self.graph.degree())
+		self.size = (self.graph.number_of_nodes(), self.graph.number_of_edges())
+		self._wl = None
+
+	@property
+	def wl(self):
+		if self._wl is None:
+			self._wl = _wl_hash(self.graph)
+		return self._wl
+
+def _wl_hash(graph, iterations=3):
+	"""
+	Weisfeiler-Lehman hash of the graph: multiset of node labels after refining by neighbour labels
 	"""
-	g1 = mwp1.get_complete_state().to_adjacency()
-	g1 = nx.from_numpy_matrix(g1)
-	g2 = mwp2.get_complete_state().to_adjacency()
-	g2 = nx.from_numpy_matrix(g2)
+	labels = {n: str(graph.degree(n)) for n in graph.nodes}
+	for _ in range(iterations):
+		labels = {n: hashlib.blake2b((labels[n] + "|" + ",".join(sorted(labels[m] for m in graph.neighbors(n))))
+									 .encode("utf-8"), digest_size=8).hexdigest() for n in graph.nodes}
+	return tuple(sorted(Counter(labels.values()).items()))
 
+def _weakly_equal(inv1, inv2):
 	# check if the two world models contain the same relation types
 	# order does not matter here
-	relations1 = mwp1.get_complete_state().relations.values()
-	relations2 = mwp2.get_complete_state().relations.values()
-	types1 = [r.type for r in relations1]
-	types2 = [r.type for r in relations2]
+	if inv1.size != inv2.size or inv1.types != inv2.types or inv1.degrees != inv2.degrees:
+		return False
+	if inv1.wl != inv2.wl:
+		return False
+	return nx.is_isomorphic(inv1.graph, inv2.graph)
+
+@profiling.timed("metrics.smatch")
+def smatch(mwp1, mwp2, full=True):
+	"""
+	Returns smatch-style precision, recall and f1 between the complete states of mwp1 (prediction) and mwp2 (gold)
+	Computed directly on the containers and relations, without the text round trip through
+	MWP.to_smatch_rep_full / to_smatch_rep_topology and an external smatch tool
+	If full is False, only the topology is compared (as in to_smatch_rep_topology)
+	mwp1 and mwp2 may also be State objects
+	"""
+	matched, total1, total2 = _smatch_counts(state_triples(mwp1, full), state_triples(mwp2, full))
+	return _prf(matched, total1, total2)
+
+
+@profiling.timed("metrics.corpus_smatch")
+def corpus_smatch(pairs, full=True, processes=None):
+	"""
+	Returns corpus-level smatch precision, recall and f1 over an iterable of (prediction, gold) pairs of MWPs or States
+	Triple counts are summed over all pairs before computing the scores, as smatch does for a corpus
+	Alignments are computed in a multiprocessing pool with the given number of processes (all cpus if None)
+	"""
+	triples = [(state_triples(pred, full), state_triples(gold, full)) for pred, gold in pairs]
+	if processes == 1:
+		counts = [_smatch_counts(*pair) for pair in triples]
+	else:
+		with Pool(processes) as pool:
+			counts = pool.starmap(_smatch_counts, triples, chunksize=max(1, len(triples) // (4 * (processes or cpu_count()))))
+	matched = sum(c[0] for c in counts)
+	total1 = sum(c[1] for c in counts)
+	total2 = sum(c[2] for c in counts)
+	return _prf(matched, total1, total2)
+
+
+def state_triples(mwp, full=True):
+	"""
+	Returns the triples of the complete state of mwp as a pair (node attributes, edges)
+	node attributes maps each node to a set of (role, value) pairs, including its instance
+	edges is a list of (relation node, role, container node)
+	Nodes are "c{id}" for containers and "r{id}" for relations
+	Unknown quantities are represented by a single placeholder, since variable names are arbitrary
+	"""
+	state = mwp.get_complete_state() if isinstance(mwp, MWP) else mwp
+	attributes = {}
+	edges = []
+
+	for container in state.containers.values():
+		node = f"c{container.id}"
+		attributes[node] = {("instance", "container")}
+		if full:
+			attributes[node].add(("name", container.label))
+			attributes[node].add(("quant", _quantity_value(container.quantity)))
+			attributes[node].update(_tuple_triples(container.tuple, ""))
+
+	for relation in state.relations.values():
+		node = f"r{relation.id}"
+		attributes[node] = {("instance", relation.type)}
+		edges.append((node, "source", f"c{relation.source.id}"))
+		edges.append((node, "destination", f"c{relation.target.id}"))
+		if not full or relation.type == "part-whole":
+			continue
+		attributes[node].add(("quant", _quantity_value(relation.quantity)))
+		if relation.type == "transfer":
+			attributes[node].update(_tuple_triples(relation.tuple, ""))
+			attributes[node].update(_optional_triples(recipient=relation.recipient, sender=relation.sender))
+		elif relation.type == "rate":
+			attributes[node].update(_tuple_triples(relation.tuple_num, "num-"))
+			attributes[node].update(_tuple_triples(relation.tuple_den, "den-"))
+		elif relation.type in ["explicit-add", "difference", "explicit-times", "explicit"]:
+			attributes[node].update(_tuple_triples(relation.res_tuple, "res-"))
+			attributes[node].update(_tuple_triples(relation.arg_tuple, "arg-"))
+			attributes[node].update(_optional_triples(result=relation.result, argument=relation.argument))
+
+	return attributes, edges
+
+
+def _quantity_value(quantity):
+	if quantity.is_variable():
+		return "unknown"
+	value = quantity.get_value()
+	if isinstance(value, float) and value.is_integer():
+		value = int(value)
+	return str(value)
+
+
+def _tuple_triples(tuple, prefix):
+	return _optional_triples(**{prefix + "entity": tuple.entity, prefix + "attribute": tuple.attribute,
+								prefix + "unit": tuple.unit})
+
+
+def _optional_triples(**values):
+	return {(role, value) for role, value in values.items() if value is not None}
+
+
+def _prf(matched, total1, total2):
+	precision = matched / total1 if total1 else 0.0
+	recall = matched / total2 if total2 else 0.0
+	f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+	return precision, recall, f1
+
+
+def _smatch_counts(triples1, triples2):
+	"""
+	Returns (matched, total1, total2) triple counts under the best alignment found between the two graphs
+	The alignment is seeded greedily by the number of matching attributes (label, entity, ...) of each node pair
+	and then refined by hill climbing over reassignments and swaps, as smatch does
+	Containers are only aligned to containers, and relations to relations
+	"""
+	attributes1, edges1 = triples1
+	attributes2, edges2 = triples2
+	total1 = sum(len(a) for a in attributes1.values()) + len(edges1)
+	total2 = sum(len(a) for a in attributes2.values()) + len(edges2)
+	edges2 = set(edges2)
+
+	nodes1 = list(attributes1.keys())
+	candidates = {n1: [n2 for n2 in attributes2 if n2[0] == n1[0]] for n1 in nodes1}
+	local = {(n1, n2): len(attributes1[n1] & attributes2[n2]) for n1 in nodes1 for n2 in candidates[n1]}
+
+	# edges by node, so that the score change of remapping a node only looks at its own edges
+	node_edges = {n1: [] for n1 in nodes1}
+	for edge in edges1:
+		node_edges[edge[0]].append(edge)
+		node_edges[edge[2]].append(edge)
+
+	def edge_matches(edges, mapping):
+		return sum((mapping.get(s), role, mapping.get(t)) in edges2 for s, role, t in edges)
+
+	def node_score(nodes, mapping):
+		"""
+		score contribution of the attributes of nodes and of all edges touching them
+		"""
+		edges = {edge for n in nodes for edge in node_edges[n]}
+		return sum(local.get((n, mapping.get(n)), 0) for n in nodes) + edge_matches(edges, mapping)
+
+	# greedy seed: best matching node pairs first
+	mapping = {}
+	used = set()
+	for (n1, n2), score in sorted(local.items(), key=lambda x: x[1], reverse=True):
+		if n1 not in mapping and n2 not in used:
+			mapping[n1] = n2
+			used.add(n2)
+
+	# refine: take the best improving reassignment or swap until none is left
+	improved = True
+	while improved:
+		improved = False
+		best_gain, best_move = 0, None
+		inverse = {n2: n1 for n1, n2 in mapping.items()}
+		for n1 in nodes1:
+			for n2 in candidates[n1]:
+				if mapping.get(n1) == n2:
+					continue
+				other = inverse.get(n2)
+				nodes = [n1] if other is None else [n1, other]
+				before = node_score(nodes, mapping)
+				moved = dict(mapping)
+				moved[n1] = n2
+				if other is not None:
+					if n1 in mapping:
+						moved[other] = mapping[n1]
+					else:
+						del moved[other]
+				gain = node_score(nodes, moved) - before
+				if gain > best_gain:
+					best_gain, best_move = gain, moved
+		if best_move is not None:
+			mapping = best_move
+			improved = True
 
-	return Counter(types1) == Counter(types2) and nx.is_isomorphic(g1, g2)
\ No newline at end of file
+	matched = sum(local.get((n, mapping.get(n)), 0) for n in nodes1) + edge_matches(edges1, mapping)
+	return matched, total1, total2
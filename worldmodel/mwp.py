@@ -59,6 +59,9 @@ class MWP:
 		# metadata: comments, flagged, background knowledge, low confidence in annotation
 		self.metadata = {}
 
+		# vocabulary of body and question as a frozenset, computed once by loader.problem_vocab
+		self.vocab = None
+
 	def __eq__(self, other):
 		# note: problem id and metadata excluded
 		# this is stronger than strong equivalence since also the ids must match
@@ -283,6 +286,33 @@ class MWP:
 			out += self.compute_diff(i, True) + "\n"
 		return out
 
+	def to_json(self):
+		"""
+		return the mwp in the annotation json format read by loader.json_to_MWP, a list with one graph per state
+		the metadata of the mwp is stored with the last state
+		"""
+		return list(self.graphs())
+
+	def graphs(self):
+		"""
+		yield the elements of to_json one state at a time
+		"""
+		if not self.parsed:
+			raise ValueError("world model not yet parsed")
+		for i in range(self.num_states):
+			yield self.states[i].to_graph(self.metadata if i == self.num_states - 1 else None)
+
+	def to_columns(self, final_only = False, containers = None, relations = None):
+		"""
+		flat columnar export of all states (or only the final one), see State.to_columns
+		"""
+		if not self.parsed:
+			raise ValueError("world model not yet parsed")
+		positions = [self.num_states - 1] if final_only else range(self.num_states)
+		for i in positions:
+			containers, relations = self.states[i].to_columns(i, containers, relations)
+		return containers, relations
+
 	def visualize(self, i:int = None):
 		"""
 		visualize state at position i
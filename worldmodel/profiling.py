@@ -0,0 +1,143 @@
+import functools
+import json
+import time
+from collections import defaultdict
+
+# instrumentation is off by default; every hook below returns immediately unless enable() was called
+enabled = False
+
+# name -> [calls, total seconds, max seconds]
+_timers = defaultdict(lambda: [0, 0.0, 0.0])
+# name -> count
+_counters = defaultdict(int)
+# name -> largest recorded value
+_maxima = {}
+
+
+def enable():
+	"""
+	turn instrumentation on
+	"""
+	global enabled
+	enabled = True
+
+
+def disable():
+	"""
+	turn instrumentation off, recorded results are kept
+	"""
+	global enabled
+	enabled = False
+
+
+def reset():
+	"""
+	clear all recorded timers and counters
+	"""
+	_timers.clear()
+	_counters.clear()
+	_maxima.clear()
+
+
+def record(name, seconds):
+	timer = _timers[name]
+	timer[0] += 1
+	timer[1] += seconds
+	timer[2] = max(timer[2], seconds)
+
+
+def timed(name):
+	"""
+	decorator that records the wall time of every call under name
+	"""
+	def decorator(f):
+		@functools.wraps(f)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return f(*args, **kwargs)
+			start = time.perf_counter()
+			try:
+				return f(*args, **kwargs)
+			finally:
+				record(name, time.perf_counter() - start)
+		return wrapper
+	return decorator
+
+
+class _Timer:
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+
+	def __exit__(self, *exc):
+		record(self.name, time.perf_counter() - self.start)
+
+
+class _NoTimer:
+
+	def __enter__(self):
+		pass
+
+	def __exit__(self, *exc):
+		pass
+
+
+_no_timer = _NoTimer()
+
+
+def timer(name):
+	"""
+	context manager that records the wall time of its block under name
+	"""
+	return _Timer(name) if enabled else _no_timer
+
+
+def start():
+	"""
+	start a timing to be recorded with stop, for code that is not a single block
+	"""
+	return time.perf_counter() if enabled else None
+
+
+def stop(name, started):
+	"""
+	record the wall time since start() under name
+	"""
+	if started is not None:
+		record(name, time.perf_counter() - started)
+
+
+def count(name, n=1):
+	"""
+	increment the counter name by n
+	"""
+	if enabled:
+		_counters[name] += n
+
+
+def maximum(name, value):
+	"""
+	keep the largest value recorded under name
+	"""
+	if enabled and value > _maxima.get(name, value - 1):
+		_maxima[name] = value
+
+
+def summary():
+	"""
+	return the recorded timers, counters and maxima as a dict
+	"""
+	timers = {name: {"calls": calls, "total": total, "mean": total / calls if calls else 0.0, "max": longest}
+			  for name, (calls, total, longest) in _timers.items()}
+	return {"timers": timers, "counters": dict(_counters), "maxima": dict(_maxima)}
+
+
+def dump(path):
+	"""
+	write summary() as json to path
+	"""
+	with open(path, "w") as f:
+		json.dump(summary(), f, indent=2, sort_keys=True)
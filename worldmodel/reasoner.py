@@ -2,18 +2,90 @@ from worldmodel.mwp import MWP
 from worldmodel.state import State
 from worldmodel.container import *
 from worldmodel.relation import *
+from worldmodel import profiling
 
-from itertools import product
+from itertools import product, takewhile
+from collections import defaultdict
+import heapq
 import random
+import time
+import numpy as np
 import sympy
 from sympy import Symbol, symbols
 from sympy.solvers import solve
 from sympy.solvers.solveset import linsolve
 from sympy.parsing.sympy_parser import parse_expr
 
+# status of the last solve of a reasoner: OK if it ran to the end (the ref may still be unresolved), otherwise the
+# limit of SolveLimits that stopped it
+OK = "ok"
+TIMEOUT = "timeout"
+MAX_DEPTH = "max_depth"
+MAX_SOLVE_CALLS = "max_solve_calls"
+MAX_EXPRESSION_SIZE = "max_expression_size"
+STATUSES = [OK, TIMEOUT, MAX_DEPTH, MAX_SOLVE_CALLS, MAX_EXPRESSION_SIZE]
+
+
+class SolveLimits:
+	"""
+	resource limits for one solve (reason, solve_all or IncrementalReasoner.update), None disables a limit
+	time: wall time in seconds, checked between steps (a single sympy solve call is not interrupted)
+	depth: recursion depth of recursive_solver
+	solve_calls: number of sympy solve calls
+	expression_size: number of nodes of an equation passed to sympy solve
+	the recursion depth is always bounded by the python recursion limit, which also ends the solve with MAX_DEPTH
+	"""
+
+	def __init__(self, time = None, depth = None, solve_calls = None, expression_size = None):
+		self.time = time
+		self.depth = depth
+		self.solve_calls = solve_calls
+		self.expression_size = expression_size
+
+	def budget(self):
+		return _Budget(self)
+
+
+class LimitExceeded(Exception):
+
+	def __init__(self, status):
+		super().__init__(status)
+		self.status = status
+
+
+class _Budget:
+	"""
+	the resources used by one solve, raises LimitExceeded when one of the limits is reached
+	"""
+
+	def __init__(self, limits):
+		self.limits = limits
+		self.deadline = time.perf_counter() + limits.time if limits.time is not None else None
+		self.solve_calls = 0
+
+	def check(self, depth = 0):
+		if self.deadline is not None and time.perf_counter() > self.deadline:
+			raise LimitExceeded(TIMEOUT)
+		if self.limits.depth is not None and depth > self.limits.depth:
+			raise LimitExceeded(MAX_DEPTH)
+
+	def solve(self, eq, var):
+		"""
+		sympy solve within the limits
+		"""
+		self.check()
+		if self.limits.solve_calls is not None and self.solve_calls >= self.limits.solve_calls:
+			raise LimitExceeded(MAX_SOLVE_CALLS)
+		if self.limits.expression_size is not None and \
+				sum(1 for _ in sympy.preorder_traversal(eq)) > self.limits.expression_size:
+			raise LimitExceeded(MAX_EXPRESSION_SIZE)
+		self.solve_calls += 1
+		return solve(eq, var)
+
+
 class DeterministicReasoner():
 
-	def __init__(self, mwp = None, state = None, ref = None, commonsense = False, orient_new = False):
+	def __init__(self, mwp = None, state = None, ref = None, commonsense = False, orient_new = False, limits = None):
 		if mwp is not None:
 			assert mwp.determined
 			self.state = mwp.get_complete_state()
@@ -22,6 +94,13 @@ class DeterministicReasoner():
 			self.state = state
 		self.orient = orient_new
 
+		# ("container" or "relation", id) -> symbol standing in for that known quantity, see compile_ref
+		self.parameters = {}
+
+		# resource limits of every solve and the status of the last one (OK or the limit that stopped it)
+		self.limits = limits if limits is not None else SolveLimits()
+		self.status = None
+
 		if commonsense:
 			pass
 
@@ -29,6 +108,7 @@ class DeterministicReasoner():
 		assert mwp.determined and not mwp.solved
 		self.state = mwp.get_complete_state()
 
+	@profiling.timed("reason")
 	def reason(self):
 		"""
 		apply reasoning to state
@@ -36,6 +116,7 @@ class DeterministicReasoner():
 		2. get ref variable/expression
 		3. get all equations associated with the problem
 		4. apply recursive solver for variable/expression over equations
+		if a limit of self.limits is reached, the unresolved ref is returned and self.status tells which limit
 		"""
 		# step 1
 		if self.orient:
@@ -58,29 +139,101 @@ class DeterministicReasoner():
 		eqs = self.get_equations()
 
 		# step 4
+		unresolved = ref
+		budget = self.limits.budget()
+		memo = {}
 		for var in target: # this will almost always only be one
-			val = self.recursive_solver(var, eqs)
+			val = self.recursive_solver(var, eqs, budget, memo)
+			if self.status != OK:
+				return unresolved
 			ref = ref.subs({var:val}) # sympy will automatically simplify this
 		return ref
 
-	def recursive_solver(self, target_var, equations):
+	@profiling.timed("solve_all")
+	def solve_all(self):
+		"""
+		solve for every variable in the state in one pass over the equation system
+		returns a dict from each symbol of the state to its value; symbols that cannot be resolved map to themselves
+		equations with a single unknown are solved, and the value is substituted only into the equations that
+		contain that symbol, until no equation with a single unknown is left
+		if a limit of self.limits is reached, the values found so far are returned and self.status tells which limit
+		"""
+		if self.orient:
+			self.infer_partwhole()
+
+		propagator = Propagator(budget=self.limits.budget())
+		propagator.add(self.get_equations())
+		self.status = propagator.run_within_limits()
+
+		values = dict(propagator.values)
+		for sym in self.get_symbols() | set(propagator.occurs.keys()):
+			values.setdefault(sym, sym)
+		return values
+
+	def get_symbols(self):
+		"""
+		return the set of variables of all containers and relations in the state
+		"""
+		quantities = [c.quantity for c in self.state.containers.values()]
+		quantities += [r.quantity for r in self.state.relations.values() if r.type != "part-whole"]
+		return {q.get_value() for q in quantities if q.is_variable()}
+
+	@profiling.timed("recursive_solver")
+	def recursive_solver(self, target_var, equations, budget = None, memo = None):
 		"""
 		recursive algorithm to solve for target_var given a list of equations
+		the solve stops when a limit of self.limits (or of the given budget, shared over several calls) is reached,
+		target_var is then returned and self.status is set to the limit, otherwise to OK
+		memo maps the variables solved so far to their values and can be shared over several calls on the same
+		equations, so that a variable reached along several paths (e.g. a shared part-whole whole) is solved once
+		failures are remembered too: a variable that could not be solved without some visited equations can not be
+		solved without more of them either
 		"""
+		if budget is None:
+			budget = self.limits.budget()
+		if memo is None:
+			memo = {}
+		# variable -> visited sets under which it could not be solved
+		failed = defaultdict(list)
+
+		# equations are visited by index; equal equations share the index of the first one, as they are equally
+		# excluded once one of them is visited
+		first = {}
+		indexed = []
+		occurs = defaultdict(list)
+		for eq in equations:
+			if isinstance(eq, sympy.Basic):
+				i = first.setdefault(eq, len(first))
+				indexed.append((i, eq))
+				for sym in eq.free_symbols:
+					occurs[sym].append(len(indexed) - 1)
 
 		def _recursive_solver(target_var, visited):
 
+			if profiling.enabled:
+				profiling.maximum("recursive_solver.depth", len(visited))
+			budget.check(len(visited))
+
+			if target_var in memo:
+				profiling.count("recursive_solver.memo_hits")
+				return memo[target_var]
+			if any(f <= visited for f in failed[target_var]):
+				profiling.count("recursive_solver.memo_hits")
+				return target_var
+
 			# get all equations containing target_var and not already visited
-			eqs = [eq for eq in equations if eq not in visited and isinstance(eq, sympy.Basic) and target_var in eq.free_symbols]
+			eqs = [indexed[j] for j in occurs.get(target_var, []) if indexed[j][0] not in visited]
 
 			# sort in increasing order according to number of free symbols
-			eqs = sorted(eqs, key=lambda x: len(x.free_symbols))
+			eqs = sorted(eqs, key=lambda x: len(x[1].free_symbols))
 
-			for eq in eqs:
+			for i, eq in eqs:
 
 				# can solve for target_var
 				if len(eq.free_symbols) == 1:
-					target_val = solve(eq, target_var)[0]
+					profiling.count("recursive_solver.solve_calls")
+					target_val = budget.solve(eq, target_var)[0]
+					memo[target_var] = target_val
 					return target_val
 
 				# can not solve for target_var
@@ -88,19 +241,30 @@ class DeterministicReasoner():
 					other_vars = eq.free_symbols.difference({target_var})
 					for other_var in other_vars:
 						# recursion
-						other_val = _recursive_solver(other_var, visited+[eq])
+						other_val = _recursive_solver(other_var, visited | {i})
 						# substitute symbol with value in equation
 						eq = eq.subs({other_var:other_val})
 
 					# now check if we can solve for target_var
 					if len(eq.free_symbols) == 1:
-						target_val = solve(eq, target_var)[0]
+						profiling.count("recursive_solver.solve_calls")
+						target_val = budget.solve(eq, target_var)[0]
+						memo[target_var] = target_val
 						return target_val
 
 			# could not solve for target_var
+			failed[target_var].append(visited)
 			return target_var
 
-		answer = _recursive_solver(target_var, [])
+		try:
+			answer = _recursive_solver(target_var, frozenset())
+		except LimitExceeded as e:
+			self.status = e.status
+			return target_var
+		except RecursionError:
+			self.status = MAX_DEPTH
+			return target_var
+		self.status = OK
 		return answer
 
 	def infer_partwhole(self):
@@ -174,6 +338,7 @@ class DeterministicReasoner():
 												tuple_num=tuple_num, tuple_den=tuple_den)
 									self.state.add_relation(rate)
 
+	@profiling.timed("get_equations")
 	def get_equations(self):
 		"""
 		return a list of sympy equations over world worldmodel
@@ -188,38 +353,58 @@ class DeterministicReasoner():
 			if r.type == "part-whole":
 				continue
 			else:
-				source_num, target_num, rel_num = self.get_values(r)
+				eq = self.get_relation_equation(r)
+				if eq is not None:
+					equations.append(eq)
 
-				if r.type == "transfer":
-					if r.source.label == r.recipient and r.target.label == r.recipient:
-						# if recipient is source and target, then source + transfer = target
-						equations.append(source_num + rel_num - target_num)
-					elif r.source.label == r.sender and r.target.label == r.sender:
-						# if sender is source and target, then source - transfer = target
-						equations.append(source_num - rel_num - target_num)
-					else:
-						raise ValueError("transfer ill-defined")
+		return equations
 
-				elif r.type == "rate":
-					equations.append(source_num - target_num * rel_num)
+	def get_relation_equation(self, r):
+		"""
+		return the equation of a single relation that is not part-whole, or None for unknown relation types
+		"""
+		source_num, target_num, rel_num = self.get_values(r)
+
+		if r.type == "transfer":
+			if r.source.label == r.recipient and r.target.label == r.recipient:
+				# if recipient is source and target, then source + transfer = target
+				return source_num + rel_num - target_num
+			elif r.source.label == r.sender and r.target.label == r.sender:
+				# if sender is source and target, then source - transfer = target
+				return source_num - rel_num - target_num
+			else:
+				raise ValueError("transfer ill-defined")
 
-				elif r.type in ["explicit-add", "difference"]:
-					equations.append(source_num + rel_num - target_num)
+		elif r.type == "rate":
+			return source_num - target_num * rel_num
 
-				elif r.type in ["explicit-times", "explicit"]:
-					equations.append(source_num * rel_num - target_num)
+		elif r.type in ["explicit-add", "difference"]:
+			return source_num + rel_num - target_num
 
-		return equations
+		elif r.type in ["explicit-times", "explicit"]:
+			return source_num * rel_num - target_num
+
+		return None
 
 	def get_values(self, relation):
 		"""
 		Get the values (sympy or number) associated with relation
 		"""
-		source_num = relation.source.quantity.get_value()
-		target_num = relation.target.quantity.get_value()
-		relation_num = relation.quantity.get_value()
+		source_num = self.get_quantity(relation.source)
+		target_num = self.get_quantity(relation.target)
+		relation_num = self.get_quantity(relation)
 		return source_num, target_num, relation_num
 
+	def get_quantity(self, obj):
+		"""
+		Get the value (sympy or number) of a container or relation, or its parameter symbol if it has one
+		"""
+		if self.parameters:
+			key = ("relation" if isinstance(obj, Relation) else "container", obj.id)
+			if key in self.parameters:
+				return self.parameters[key]
+		return obj.quantity.get_value()
+
 	def get_partwhole_equations(self):
 		"""
 		get equations associated with a part-whole relations
@@ -240,20 +425,336 @@ class DeterministicReasoner():
 			if whole.id in wholes:
 				continue
 
-			id_quantities = [(whole.id, whole.quantity)]
-
 			# all part-wholes oriented towards the current whole
 			inner_partwholes = [r for r in partwholes if r.target == whole]
-			for r in inner_partwholes:
-				id_quantities.append((r.source.id, r.source.quantity))
-
-			expr = whole.quantity.get_value()
-			for _, q in id_quantities[1:]:  # skip the whole quantity
-				# sympy is useful here
-				expr -= q.get_value()
-			equations.append(expr)
+			equations.append(self.get_whole_equation(whole, inner_partwholes))
 
 			# add to wholes
 			wholes.add(whole.id)
 
-		return equations
\ No newline at end of file
+		return equations
+
+	def get_whole_equation(self, whole, inner_partwholes):
+		"""
+		return the equation whole - sum of parts for the part-whole relations oriented towards whole
+		"""
+		expr = self.get_quantity(whole)
+		for r in inner_partwholes:
+			# sympy is useful here
+			expr -= self.get_quantity(r.source)
+		return expr
+
+	def compile_ref(self):
+		"""
+		compile the equation system of the state into a closed-form evaluator for the ref
+		every known quantity becomes an input; the unknowns are eliminated symbolically by propagation
+		(as in solve_all), and the resulting expression is turned into a numpy function with lambdify
+		raises ValueError if the ref cannot be determined from the known quantities
+		"""
+		if self.orient:
+			self.infer_partwhole()
+
+		self.parameters = {}
+		defaults = []
+		for c in self.state.containers.values():
+			if c.is_known():
+				self.parameters[("container", c.id)] = sympy.Dummy(f"c{c.id}")
+				defaults.append(c.get_value())
+		for r in self.state.relations.values():
+			if r.type != "part-whole" and r.is_known():
+				self.parameters[("relation", r.id)] = sympy.Dummy(f"r{r.id}")
+				defaults.append(r.get_value())
+
+		try:
+			propagator = Propagator(parameters=set(self.parameters.values()))
+			propagator.add(self.get_equations())
+			propagator.run()
+		finally:
+			parameters = self.parameters
+			self.parameters = {}
+
+		expr = sympy.sympify(self.state.get_ref()).subs(propagator.values)
+		if expr.free_symbols - set(parameters.values()):
+			raise ValueError("ref cannot be determined from the known quantities")
+		return CompiledRef(list(parameters.keys()), list(parameters.values()), defaults, expr)
+
+
+class Propagator:
+	"""
+	solves a growing system of equations by propagation: an equation with a single unknown is solved, and the value
+	is substituted into the other equations containing that symbol
+	equations are solved earliest first, as in recursive_solver (this only matters for inconsistent systems)
+	"""
+
+	def __init__(self, parameters = None, budget = None):
+		# symbols that are treated as known inputs rather than unknowns, see DeterministicReasoner.compile_ref
+		self.parameters = parameters if parameters is not None else set()
+		# resource budget of the sympy solve calls (see SolveLimits), unlimited if None
+		self.budget = budget
+		# equations as added, and their current form with known values substituted
+		self.originals = []
+		self.equations = []
+		# symbol -> indices of the equations it occurs in
+		self.occurs = defaultdict(set)
+		# symbol -> value, only for solved symbols
+		self.values = {}
+		# solved symbol -> index of the equation it was solved with, and back
+		self.solved_by = {}
+		self.solved = {}
+		# symbol -> symbols solved with an equation its value was substituted in
+		self.used_by = defaultdict(set)
+		self.queue = []
+
+	def add(self, equations):
+		"""
+		add equations to the system, substituting the values known so far
+		returns the index of each equation, None for those that are not sympy expressions and are left out
+		"""
+		indices = []
+		for eq in equations:
+			if not isinstance(eq, sympy.Basic):
+				indices.append(None)
+				continue
+			i = len(self.equations)
+			self.originals.append(eq)
+			self.equations.append(eq)
+			for sym in self.unknowns(eq):
+				self.occurs[sym].add(i)
+			self.substitute(i)
+			indices.append(i)
+		return indices
+
+	def replace(self, i, eq):
+		"""
+		replace equation i by eq, forgetting the value solved with it and the values derived from that one
+		"""
+		for sym in self.unknowns(self.originals[i]) - self.unknowns(eq):
+			self.occurs[sym].discard(i)
+		self.originals[i] = eq
+		for sym in self.unknowns(eq):
+			self.occurs[sym].add(i)
+		self.forget([self.solved[i]] if i in self.solved else [])
+		self.substitute(i)
+
+	def forget(self, symbols):
+		"""
+		forget the values of symbols and of all values derived from them, and restore the equations they were
+		substituted in
+		"""
+		equations = set()
+		while symbols:
+			sym = symbols.pop()
+			if sym not in self.values:
+				continue
+			del self.values[sym]
+			del self.solved[self.solved_by.pop(sym)]
+			symbols.extend(self.used_by.pop(sym, ()))
+			equations |= self.occurs[sym]
+		for i in sorted(equations):
+			self.substitute(i)
+
+	def substitute(self, i):
+		"""
+		set equation i to its original with the values known so far, and queue it if it has a single unknown
+		"""
+		eq = self.originals[i]
+		known = {sym: self.values[sym] for sym in eq.free_symbols if sym in self.values}
+		self.equations[i] = eq.subs(known) if known else eq
+		if len(self.unknowns(self.equations[i])) == 1:
+			heapq.heappush(self.queue, i)
+
+	def unknowns(self, eq):
+		if not self.parameters:
+			return eq.free_symbols
+		return eq.free_symbols - self.parameters
+
+	def run(self):
+		"""
+		propagate until no equation with a single unknown is left
+		returns the symbols solved in this run
+		"""
+		solved = []
+		while self.queue:
+			i = self.queue[0]
+			unknowns = self.unknowns(self.equations[i])
+			if len(unknowns) != 1:
+				# already solved through another equation
+				heapq.heappop(self.queue)
+				continue
+			sym = next(iter(unknowns))
+			solutions = self.budget.solve(self.equations[i], sym) if self.budget is not None \
+				else solve(self.equations[i], sym)
+			# only dequeued once solved, so that a run stopped by the budget can be resumed
+			heapq.heappop(self.queue)
+			if not solutions:
+				continue
+			self.values[sym] = solutions[0]
+			self.solved_by[sym] = i
+			self.solved[i] = sym
+			for other in self.unknowns(self.originals[i]) - {sym}:
+				self.used_by[other].add(sym)
+			solved.append(sym)
+			for j in self.occurs[sym]:
+				self.equations[j] = self.equations[j].subs({sym: self.values[sym]})
+				if len(self.unknowns(self.equations[j])) == 1:
+					heapq.heappush(self.queue, j)
+		return solved
+
+	def run_within_limits(self):
+		"""
+		run, and return OK or the limit of the budget that stopped the propagation
+		the values found until then are kept, and propagation can be resumed with a new budget
+		"""
+		try:
+			self.run()
+		except LimitExceeded as e:
+			return e.status
+		return OK
+
+
+class IncrementalReasoner(DeterministicReasoner):
+	"""
+	reasoner over the successive states of an MWP, where state i+1 extends state i
+	the partially solved system is carried from one state to the next: only the equations of new relations are
+	added and only newly determined values are propagated, so reasoning over all prefixes of a problem is linear
+	overall rather than quadratic
+	equations are only built for what a state adds: its new relations (added after the ones of the previous state)
+	and the wholes they give parts to, whose equation is replaced; the relations and containers of the previous
+	state are only checked to be the same objects, as with State.copy, or to have the same quantities
+	if relations or containers were removed or a quantity changed (e.g. a variable is given in a later sentence,
+	which can rename the other variables), the system is rebuilt from that state
+	"""
+
+	def __init__(self, commonsense = False, orient_new = False, limits = None):
+		super().__init__(commonsense=commonsense, orient_new=orient_new, limits=limits)
+		self.state = None
+		self.reset()
+
+	def reset(self):
+		self.propagator = Propagator(budget=self.limits.budget())
+		# id -> (relation or container, value or symbol of its quantity) for the current state, in order
+		self.relations = {}
+		self.containers = {}
+		# whole container id -> [whole - sum of its parts, index of that equation in the propagator]
+		self.wholes = {}
+
+	def update(self, state):
+		"""
+		move to state, which should extend the current state, and return the values of all its symbols
+		unresolved symbols map to themselves
+		the limits of self.limits apply to each update, self.status tells whether one was reached
+		"""
+		self.state = state
+		if self.orient:
+			self.infer_partwhole()
+
+		relations = self.added(state.relations, self.relations)
+		containers = self.added(state.containers, self.containers)
+		if relations is None or containers is None or self.changed(state.relations, self.relations) \
+				or self.changed(state.containers, self.containers):
+			self.reset()
+			relations, containers = list(state.relations), list(state.containers)
+		for id in relations:
+			self.relations[id] = (state.relations[id], self.get_quantity_value(state.relations[id]))
+		for id in containers:
+			self.containers[id] = (state.containers[id], self.get_quantity_value(state.containers[id]))
+
+		new_equations = []
+		parts = defaultdict(list)
+		for id in relations:
+			r = state.relations[id]
+			if r.type == "part-whole":
+				parts[r.target.id].append(r)
+			else:
+				new_equations.append(self.get_relation_equation(r))
+		self.propagator.add(new_equations)
+		for whole_id, whole_parts in parts.items():
+			if whole_id in self.wholes:
+				whole = self.wholes[whole_id]
+				whole[0] -= sum(self.get_quantity(r.source) for r in whole_parts)
+				self.propagator.replace(whole[1], whole[0])
+			else:
+				eq = sympy.sympify(self.get_whole_equation(state.containers[whole_id], whole_parts))
+				self.wholes[whole_id] = [eq, self.propagator.add([eq])[0]]
+
+		self.propagator.budget = self.limits.budget()
+		self.status = self.propagator.run_within_limits()
+		return self.get_values_dict()
+
+	def get_quantity_value(self, obj):
+		"""
+		value or symbol of the quantity of a relation or container, None if it has none
+		"""
+		quantity = getattr(obj, "quantity", None)
+		return quantity.get_value() if quantity is not None else None
+
+	def added(self, items, known):
+		"""
+		the ids of items (relations or containers by id) that are not known, which should all be at the end
+		None if some of the known ids are no longer in items
+		"""
+		added = list(takewhile(lambda id: id not in known, reversed(items)))[::-1]
+		return added if len(known) + len(added) == len(items) else None
+
+	def changed(self, items, known):
+		"""
+		whether one of the known items was replaced by one with another quantity
+		the items shared by states copied with State.copy are not modified, so only replaced items are compared
+		"""
+		return any(items.get(id) is not item and self.get_quantity_value(items.get(id)) != value
+				   for id, (item, value) in known.items())
+
+	def get_values_dict(self):
+		"""
+		values of all symbols of the current state and of the equation system, unresolved symbols map to themselves
+		"""
+		values = self.propagator.values
+		symbols = self.get_symbols() | set(self.propagator.occurs.keys())
+		return {sym: values.get(sym, sym) for sym in symbols}
+
+	def reason(self):
+		"""
+		value of the ref of the current state
+		"""
+		return self.state.get_ref().subs(self.propagator.values)
+
+	def reason_states(self, mwp):
+		"""
+		return a dict from state index to the values of all symbols in that state
+		"""
+		self.reset()
+		values = {}
+		for i in sorted(mwp.states.keys()):
+			values[i] = self.update(mwp.states[i])
+		return values
+
+
+class CompiledRef:
+	"""
+	closed-form evaluator of the ref of a state, as a function of its known quantities
+	inputs are ("container" or "relation", id) keys, defaults are the quantities given in the state
+	"""
+
+	def __init__(self, inputs, symbols, defaults, expr):
+		self.inputs = inputs
+		self.defaults = defaults
+		self.expr = expr
+		self.function = sympy.lambdify(symbols, expr, "numpy")
+
+	def __call__(self, values = None, **kwargs):
+		"""
+		evaluate the ref for many assignments at once
+		values maps input keys to numbers or numpy arrays (which are broadcast together); inputs that are not
+		given keep their default
+		"""
+		values = values if values is not None else {}
+		args = [np.asarray(values.get(key, default), dtype=float) for key, default in zip(self.inputs, self.defaults)]
+		shape = np.broadcast_shapes(*[a.shape for a in args]) if args else ()
+		return np.broadcast_to(np.asarray(self.function(*args), dtype=float), shape)
+
+	def evaluate(self, X):
+		"""
+		evaluate the ref for each row of X, an array of shape (n, len(inputs)) with columns in the order of inputs
+		"""
+		X = np.asarray(X, dtype=float)
+		return np.broadcast_to(np.asarray(self.function(*X.T), dtype=float), X.shape[:1])
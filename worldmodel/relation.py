@@ -1,4 +1,4 @@
-from worldmodel.container import Container
+from worldmodel.container import Container, _empty
 from worldmodel.tuple import EntityTuple
 from worldmodel.quantity import Quantity
 from worldmodel.misc import is_fraction, is_int, is_float
@@ -6,6 +6,9 @@ from worldmodel.misc import is_fraction, is_int, is_float
 from sympy import Rational
 import random
 
+# the relation types, as given by Relation.type
+RELATION_TYPES = ["transfer", "rate", "part-whole", "difference", "explicit"]
+
 class Relation:
 
 	def __init__(self, id, source, target):
@@ -108,6 +111,19 @@ class Relation:
 	def get_dict(self):
 		pass
 
+	def to_edge(self):
+		"""
+		edge in the annotation json format, see loader.json_to_MWP
+		"""
+		return self._edge({})
+
+	def _edge(self, metadata, relation = None):
+		# a quantity that was a variable before its value was set keeps the variable name
+		if self.quantity.is_known() and self.quantity.var is not None:
+			metadata["variable"] = str(self.quantity.var)
+		return {"id": str(self.id), "source": str(self.source.id), "target": str(self.target.id),
+				"relation": self.type if relation is None else relation, "metadata": metadata}
+
 	@property
 	def type(self):
 		pass
@@ -177,6 +193,10 @@ class Transfer(Relation):
 		out["sender"] = self.sender
 		return out
 
+	def to_edge(self):
+		return self._edge({"X1": str(self.quantity), "X2": _tuple_list(self.tuple), "X3": _empty(self.recipient),
+						   "X4": _empty(self.sender)})
+
 class Rate(Relation):
 
 	def __init__(self, id, source, target, quantity, tuple_num, tuple_den):
@@ -238,6 +258,9 @@ class Rate(Relation):
 		out["unit_den"] = self.tuple_den.unit
 		return out
 
+	def to_edge(self):
+		return self._edge({"X1": str(self.quantity), "X2": _tuple_list(self.tuple_num), "X3": _tuple_list(self.tuple_den)})
+
 
 class PartWhole(Relation):
 
@@ -364,6 +387,9 @@ class ExplicitAdd(Relation):
 		out["argument"] = self.argument
 		return out
 
+	def to_edge(self):
+		return self._edge(_explicit_metadata(self), relation="explicit-add")
+
 class ExplicitTimes(Relation):
 
 	def __init__(self, id, source, target, quantity, res_tuple, arg_tuple, result, argument):
@@ -434,4 +460,29 @@ class ExplicitTimes(Relation):
 		out["arg_unit"] = self.arg_tuple.unit
 		out["result"] = self.result
 		out["argument"] = self.argument
-		return out
\ No newline at end of file
+		return out
+
+	def to_edge(self):
+		return self._edge(_explicit_metadata(self), relation="explicit-times")
+
+
+def _tuple_list(tuple):
+	return [tuple.entity, _empty(tuple.attribute), _empty(tuple.unit)]
+
+
+def _explicit_metadata(relation):
+	"""
+	metadata of explicit-add and explicit-times edges
+	the annotation format holds a single tuple X2; the loader takes the tuples from the containers if result and
+	argument are equal, and uses X2 for both otherwise. if that would not give back the relation's tuples, the
+	argument tuple is added as X5
+	"""
+	metadata = {"X1": str(relation.quantity), "X2": _tuple_list(relation.res_tuple), "X3": relation.result,
+				"X4": relation.argument}
+	if relation.result == relation.argument:
+		implied = relation.target.tuple == relation.res_tuple and relation.source.tuple == relation.arg_tuple
+	else:
+		implied = relation.res_tuple == relation.arg_tuple
+	if not implied:
+		metadata["X5"] = _tuple_list(relation.arg_tuple)
+	return metadata
@@ -1,4 +1,4 @@
-from worldmodel.container import Container
+from worldmodel.container import Container, _empty
 from worldmodel.relation import *
 from worldmodel.tuple import EntityTuple
 from utils import viz_helper
@@ -8,6 +8,17 @@ from sympy import symbols, Rational
 from sympy.parsing.sympy_parser import parse_expr
 
 import numpy as np
+from scipy import sparse
+
+# columns of the flat tables returned by State.to_columns, one row per container and one per relation
+# the entity tuples of relations are flattened into entity, attribute, unit columns, num_/den_ prefixed for rates and
+# res_/arg_ prefixed for explicit relations
+CONTAINER_COLUMNS = ["problem_id", "state", "id", "label", "entity", "attribute", "unit", "quantity", "value",
+					 "is_variable"]
+RELATION_TUPLES = {"tuple": "", "tuple_num": "num_", "tuple_den": "den_", "res_tuple": "res_", "arg_tuple": "arg_"}
+RELATION_COLUMNS = ["problem_id", "state", "id", "type", "source", "target", "quantity", "value", "is_variable",
+					"recipient", "sender", "result", "argument"] + \
+				   [prefix + field for prefix in RELATION_TUPLES.values() for field in ["entity", "attribute", "unit"]]
 
 class State:
 	# meant for each intermediate world worldmodel state up until (inclusive) a given text span
@@ -39,18 +50,55 @@ class State:
 		# variables as str
 		self.vars = []
 
+		# container id -> row/column position in adjacency exports, in order of insertion
+		self.id2pos = {}
+
 	def __eq__(self, other):
 		return isinstance(other, State) and self.span == other.span and self.containers == other.containers \
 			and self.relations == other.relations
 
+	def copy(self, span=None):
+		"""
+		shallow copy that shares the containers and relations, which are not modified once added
+		use copy.deepcopy instead if containers are updated, see update_container
+		"""
+		state = State(problem_id=self.id, span=self.span if span is None else span)
+		state.containers = dict(self.containers)
+		state.relations = dict(self.relations)
+		state.answer = self.answer
+		state.ref = self.ref
+		state.vars = list(self.vars)
+		state.id2pos = dict(self.id2pos)
+		return state
+
 	def add_container(self, container):
 		if not isinstance(container, Container):
 			raise TypeError("container must be of type Container")
 		self.containers[container.id] = container
+		if container.id not in self.id2pos:
+			self.id2pos[container.id] = len(self.id2pos)
 		# add to vars if variable
 		if container.quantity.is_variable():
 			self.vars.append(str(container.quantity.get_value()))
 
+	def remove_container(self, container_id):
+		"""
+		remove a container and the relations from or to it
+		the positions of the remaining containers (id2pos) keep their order and are renumbered without gaps
+		"""
+		container = self.containers.pop(container_id)
+		removed = [container.quantity]
+		for relation_id in [id for id, r in self.relations.items()
+							if r.source.id == container_id or r.target.id == container_id]:
+			relation = self.relations.pop(relation_id)
+			if relation.type != "part-whole":
+				removed.append(relation.quantity)
+		for quantity in removed:
+			if quantity.is_variable() and str(quantity.get_value()) in self.vars:
+				self.vars.remove(str(quantity.get_value()))
+		order = sorted((pos, id) for id, pos in self.id2pos.items() if id in self.containers)
+		self.id2pos = {id: i for i, (_, id) in enumerate(order)}
+
 	def update_container(self, container_id, value):
 		"""
 		Update an existing container by setting a variable quantity to a value
@@ -279,24 +327,144 @@ class State:
 
 			return out.strip()
 
+	def to_graph(self, metadata = None):
+		"""
+		return the state as one element of the annotation json format read by loader.json_to_MWP
+		the answer and ref are held by the question container node CQ, labeled like the container holding the ref
+		metadata (e.g. of the mwp) is added to the graph metadata next to the text span
+		"""
+		nodes = {str(i): c.to_node() for i, c in self.containers.items()}
+		if self.has_ref() or self.has_answer():
+			holders = [c for c in self.containers.values() if self.has_ref() and c.quantity.get_value() == self.ref]
+			nodes["CQ"] = {"label": holders[-1].label if holders else "",
+						   "metadata": {"entity": holders[-1].tuple.entity if holders else "",
+										"quantity": str(self.answer) if self.has_answer() else "",
+										"unit": _empty(holders[-1].tuple.unit) if holders else "",
+										"attribute": _empty(holders[-1].tuple.attribute) if holders else "",
+										"reference": str(self.ref) if self.has_ref() else ""}}
+		graph_metadata = {"text span": self.span}
+		if metadata:
+			graph_metadata.update(metadata)
+		edges = [r.to_edge() for r in self.relations.values()]
+		return {"graph": {"id": self.id, "metadata": graph_metadata, "nodes": nodes, "edges": edges}}
+
+	def to_columns(self, index = None, containers = None, relations = None):
+		"""
+		flat columnar export: return (containers, relations), dicts from column name (CONTAINER_COLUMNS and
+		RELATION_COLUMNS) to lists with one entry per container / relation, index is the position of the state in its mwp
+		quantity is the quantity as str and value its numeric value (None for variables), part-whole relations have
+		neither; rows are appended to the given dicts if any, so that many states can be collected into one table
+		"""
+		if containers is None:
+			containers = {column: [] for column in CONTAINER_COLUMNS}
+		if relations is None:
+			relations = {column: [] for column in RELATION_COLUMNS}
+		for c in self.containers.values():
+			for column, value in zip(CONTAINER_COLUMNS, (self.id, index, c.id, c.label, c.tuple.entity,
+					c.tuple.attribute, c.tuple.unit) + _quantity_columns(c.quantity)):
+				containers[column].append(value)
+		for r in self.relations.values():
+			quantity = (None, None, None) if r.type == "part-whole" else _quantity_columns(r.quantity)
+			row = (self.id, index, r.id, r.type, r.source.id, r.target.id) + quantity + \
+				tuple(getattr(r, attribute, None) for attribute in ["recipient", "sender", "result", "argument"])
+			for attribute in RELATION_TUPLES:
+				t = getattr(r, attribute, None)
+				row += (None, None, None) if t is None else (t.entity, t.attribute, t.unit)
+			for column, value in zip(RELATION_COLUMNS, row):
+				relations[column].append(value)
+		return containers, relations
+
 	def to_adjacency(self):
 		"""
 		gives an adjacency matrix of the graph
 		"""
 		adj = np.zeros([len(self.containers),len(self.containers)])
-
-		# id2pos solves the issue of ids not having been incremented properly
-		id2pos = {id: i for i, id in enumerate(list(self.containers.keys()))}
-		for relation in self.relations.values():
-			sid = relation.source.id
-			tid = relation.target.id
-			s_num = id2pos[sid]
-			t_num = id2pos[tid]
-			adj[s_num, t_num] = 1
+		rows, cols, _ = self._edge_positions()
+		adj[rows, cols] = 1
 		return adj
 
+	def to_sparse_adjacency(self, format="csr"):
+		"""
+		gives a sparse adjacency matrix of the graph (scipy coo or csr)
+		entries count the relations from source to target, so direction and multiplicity are kept
+		"""
+		n = len(self.containers)
+		rows, cols, _ = self._edge_positions()
+		adj = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+		return adj.asformat(format)
+
+	def to_typed_adjacency(self, types=RELATION_TYPES, format="csr"):
+		"""
+		gives one sparse adjacency matrix per relation type, in the order of types
+		relations of a type not in types are left out
+		"""
+		n = len(self.containers)
+		rows, cols, rel_types = self._edge_positions()
+		out = []
+		for rel_type in types:
+			mask = rel_types == rel_type
+			adj = sparse.coo_matrix((np.ones(mask.sum()), (rows[mask], cols[mask])), shape=(n, n))
+			out.append(adj.asformat(format))
+		return out
+
+	def _edge_positions(self):
+		"""
+		source positions, target positions and types of all relations, in one pass over the relations
+		positions follow the order in which containers were added (id2pos), which solves the issue of ids
+		not having been incremented properly
+		"""
+		# containers deleted from (or put into) the dict directly leave id2pos stale, insertion order is used then
+		id2pos = self.id2pos if self.id2pos.keys() == self.containers.keys() else \
+			{id: i for i, id in enumerate(self.containers.keys())}
+		rows = np.empty(len(self.relations), dtype=np.int64)
+		cols = np.empty(len(self.relations), dtype=np.int64)
+		rel_types = np.empty(len(self.relations), dtype=object)
+		for i, relation in enumerate(self.relations.values()):
+			rows[i] = id2pos[relation.source.id]
+			cols[i] = id2pos[relation.target.id]
+			rel_types[i] = relation.type
+		return rows, cols, rel_types
+
 	def visualize(self):
 		"""
 		plot the state
 		"""
-		viz_helper.visualize_mwp_state(self, mwp_name=self.id, show_plot=True)
\ No newline at end of file
+		viz_helper.visualize_mwp_state(self, mwp_name=self.id, show_plot=True)
+
+def _quantity_columns(quantity):
+	"""
+	quantity, value and is_variable columns of a quantity
+	"""
+	if quantity.is_variable():
+		return str(quantity.get_value()), None, True
+	return str(quantity.get_value()), float(quantity.get_value()), False
+
+def batch_adjacency(states, typed=False, types=RELATION_TYPES, format="csr"):
+	"""
+	pack the adjacency matrices of many states into one block-diagonal sparse matrix
+	if typed, return one block-diagonal matrix per relation type instead
+	also returns the offsets: the containers of states[i] are at positions offsets[i] to offsets[i+1]-1
+	"""
+	offsets = np.zeros(len(states) + 1, dtype=np.int64)
+	rows, cols, rel_types = [], [], []
+	for i, state in enumerate(states):
+		r, c, t = state._edge_positions()
+		rows.append(r + offsets[i])
+		cols.append(c + offsets[i])
+		rel_types.append(t)
+		offsets[i + 1] = offsets[i] + len(state.containers)
+	n = offsets[-1]
+	rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+	cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+	rel_types = np.concatenate(rel_types) if rel_types else np.empty(0, dtype=object)
+
+	if not typed:
+		adj = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+		return adj.asformat(format), offsets
+
+	out = []
+	for rel_type in types:
+		mask = rel_types == rel_type
+		adj = sparse.coo_matrix((np.ones(mask.sum()), (rows[mask], cols[mask])), shape=(n, n))
+		out.append(adj.asformat(format))
+	return out, offsets
@@ -0,0 +1,233 @@
+"""
+check that annotated world models reason to their gold answers
+
+every annotation is loaded, DeterministicReasoner is run on its complete state and the result is compared, with a
+tolerance, against the answer annotated in the final state (or the answer in a gold csv with columns problem_id and
+answer, if given); each problem gets one status:
+	correct: the reasoned answer matches the gold answer
+	wrong_value: the reasoned answer is a number different from the gold answer
+	unsolvable: the reasoned answer still has free variables
+	ill_defined_transfer: a transfer whose source and target are neither both the recipient nor both the sender
+	timeout: reasoning took longer than the timeout
+	resource_limit: reasoning reached another limit of SolveLimits (recursion depth, solve calls, expression size)
+	undetermined: the world model has no reference variable to reason for
+	no_gold: there is no gold answer to compare with
+	load_error, error: loading or reasoning raised another exception
+
+usage (from the repository root):
+	python -m worldmodel.verify                              # all splits in output_files/data
+	python -m worldmodel.verify --splits asdiv/test mawps/test --processes 8 --output verification.json
+
+the report is a json file with counts per status (overall and per split) and one record per problem; the exit code
+is 1 if any problem failed, so that it can be run after every annotation batch
+"""
+from worldmodel.loader import json_to_MWP
+from worldmodel.reasoner import DeterministicReasoner, SolveLimits, OK, TIMEOUT
+
+import argparse
+import contextlib
+import csv
+import functools
+import glob
+import io
+import json
+import math
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool
+import sympy
+
+DATA_DIR = os.path.join("output_files", "data")
+STATUSES = ["correct", "wrong_value", "unsolvable", "ill_defined_transfer", "timeout", "resource_limit", "undetermined", "no_gold",
+			"load_error", "error"]
+# statuses that are not counted as failures
+PASSED = ["correct"]
+
+
+class Timeout(Exception):
+	pass
+
+
+def _alarm(signum, frame):
+	raise Timeout()
+
+
+@contextlib.contextmanager
+def _time_limit(seconds):
+	"""
+	raise Timeout in the block after seconds of wall time (no limit if None); uses SIGALRM, so only in the main thread
+	"""
+	if not seconds:
+		yield
+		return
+	previous = signal.signal(signal.SIGALRM, _alarm)
+	signal.setitimer(signal.ITIMER_REAL, seconds)
+	try:
+		yield
+	finally:
+		signal.setitimer(signal.ITIMER_REAL, 0)
+		signal.signal(signal.SIGALRM, previous)
+
+
+def split_paths(splits=None, data_dir=DATA_DIR):
+	"""
+	annotation paths of the given splits ("dataset/split", e.g. "asdiv/test"), all splits in data_dir if None
+	"""
+	patterns = [os.path.join(data_dir, "*", "*", "*.json")] if not splits else \
+		[os.path.join(data_dir, split, "*.json") for split in splits]
+	return sorted(path for pattern in patterns for path in glob.glob(pattern))
+
+
+def read_gold(path):
+	"""
+	problem id -> answer from a csv with columns problem_id (or id) and answer
+	"""
+	with open(path, newline="") as f:
+		return {row.get("problem_id", row.get("id")): row["answer"] for row in csv.DictReader(f)}
+
+
+def _split(path):
+	return "/".join(os.path.normpath(path).split(os.sep)[-3:-1])
+
+
+def _float(value):
+	# fractions such as 10/3 are stored as str in the annotations and gold csv
+	return float(sympy.sympify(value)) if isinstance(value, str) else float(value)
+
+
+def is_close(value, gold, rel_tol=1e-6, abs_tol=1e-6):
+	return math.isclose(_float(value), _float(gold), rel_tol=rel_tol, abs_tol=abs_tol)
+
+
+def verify_path(path, gold=None, timeout=None, rel_tol=1e-6, abs_tol=1e-6, limits=None):
+	"""
+	verify the annotation at path and return its record: id, split, path, status, answer, gold, seconds, message
+	gold is an optional dict from problem id to answer that takes precedence over the annotated answer
+	limits are the SolveLimits of the reasoner; the timeout is also enforced with SIGALRM, which interrupts a single
+	long sympy call as well
+	"""
+	record = {"id": None, "split": _split(path), "path": path, "status": None, "answer": None, "gold": None,
+			  "seconds": 0.0, "message": None}
+	try:
+		mwp = json_to_MWP(path)
+	except Exception as e:
+		record.update(status="load_error", message=repr(e))
+		return record
+	record["id"] = mwp.id
+
+	final = mwp.get_complete_state()
+	if gold is not None and mwp.id in gold:
+		record["gold"] = gold[mwp.id]
+	elif final is not None and final.has_answer():
+		record["gold"] = str(final.get_answer())
+	if not mwp.determined:
+		record["status"] = "undetermined"
+		return record
+
+	start = time.perf_counter()
+	try:
+		with _time_limit(timeout), contextlib.redirect_stdout(io.StringIO()):
+			reasoner = DeterministicReasoner(mwp=mwp, limits=limits)
+			answer = reasoner.reason()
+	except Timeout:
+		record.update(status="timeout", message=f"no answer after {timeout}s")
+		return record
+	except ValueError as e:
+		record["status"] = "ill_defined_transfer" if "transfer ill-defined" in str(e) else "error"
+		record["message"] = repr(e)
+		return record
+	except Exception as e:
+		record.update(status="error", message=repr(e))
+		return record
+	finally:
+		record["seconds"] = time.perf_counter() - start
+
+	record["answer"] = str(answer)
+	if reasoner.status not in [None, OK]:
+		record["status"] = "timeout" if reasoner.status == TIMEOUT else "resource_limit"
+		record["message"] = reasoner.status
+	elif getattr(answer, "free_symbols", None):
+		record["status"] = "unsolvable"
+	elif record["gold"] is None:
+		record["status"] = "no_gold"
+	else:
+		try:
+			record["status"] = "correct" if is_close(answer, record["gold"], rel_tol, abs_tol) else "wrong_value"
+		except (TypeError, ValueError, sympy.SympifyError) as e:
+			record.update(status="error", message=repr(e))
+	return record
+
+
+def summarize(records):
+	"""
+	counts per status, overall and per split
+	"""
+	def counts(rs):
+		c = Counter(r["status"] for r in rs)
+		out = {status: c[status] for status in STATUSES}
+		out["total"] = len(rs)
+		out["failed"] = len(rs) - sum(c[status] for status in PASSED)
+		return out
+
+	splits = sorted({r["split"] for r in records})
+	return {"overall": counts(records), "splits": {s: counts([r for r in records if r["split"] == s]) for s in splits}}
+
+
+def verify_corpus(paths, gold=None, timeout=10.0, processes=None, rel_tol=1e-6, abs_tol=1e-6, limits=None):
+	"""
+	verify every annotation path in a multiprocessing pool (all cpus if None, in this process if 1)
+	returns the report: summary (see summarize), seconds and the records sorted by path
+	"""
+	start = time.perf_counter()
+	if limits is None:
+		limits = SolveLimits(time=timeout)
+	verify = functools.partial(verify_path, gold=gold, timeout=timeout, rel_tol=rel_tol, abs_tol=abs_tol,
+							   limits=limits)
+	if processes == 1:
+		records = [verify(path) for path in paths]
+	else:
+		with Pool(processes) as pool:
+			records = list(pool.imap_unordered(verify, paths, chunksize=16))
+	records.sort(key=lambda r: r["path"])
+	return {"summary": summarize(records), "seconds": time.perf_counter() - start, "problems": records}
+
+
+def main():
+	parser = argparse.ArgumentParser(description="check that annotated world models reason to their gold answers")
+	parser.add_argument("--data", default=DATA_DIR, help="directory with one dataset/split/*.json tree")
+	parser.add_argument("--splits", nargs="+", default=None, help="splits to check, e.g. asdiv/test (default all)")
+	parser.add_argument("--gold", default=None, help="csv with columns problem_id and answer, overrides the annotation")
+	parser.add_argument("--timeout", type=float, default=10.0, help="seconds of reasoning per problem (0 for none)")
+	parser.add_argument("--max-depth", type=int, default=None, help="recursion depth limit of the reasoner")
+	parser.add_argument("--max-solve-calls", type=int, default=None, help="sympy solve calls per problem")
+	parser.add_argument("--max-expression-size", type=int, default=None, help="nodes of an equation passed to solve")
+	parser.add_argument("--processes", type=int, default=None, help="worker processes (default all cpus)")
+	parser.add_argument("--rel-tol", type=float, default=1e-6, help="relative tolerance of the comparison")
+	parser.add_argument("--abs-tol", type=float, default=1e-6, help="absolute tolerance of the comparison")
+	parser.add_argument("--output", default="verification.json", help="where to write the report")
+	parser.add_argument("--failures-only", action="store_true", help="only keep failed problems in the report")
+	args = parser.parse_args()
+
+	paths = split_paths(args.splits, args.data)
+	gold = read_gold(args.gold) if args.gold else None
+	limits = SolveLimits(args.timeout or None, args.max_depth, args.max_solve_calls, args.max_expression_size)
+	report = verify_corpus(paths, gold, args.timeout or None, args.processes, args.rel_tol, args.abs_tol, limits)
+	if args.failures_only:
+		report["problems"] = [r for r in report["problems"] if r["status"] not in PASSED]
+	with open(args.output, "w") as f:
+		json.dump(report, f, indent=2)
+		f.write("\n")
+
+	overall = report["summary"]["overall"]
+	for split, counts in report["summary"]["splits"].items():
+		print(f"{split}: {counts['total'] - counts['failed']}/{counts['total']} correct")
+	print(", ".join(f"{status} {overall[status]}" for status in STATUSES if overall[status]))
+	print(f"report written to {args.output} ({report['seconds']:.1f}s)")
+	sys.exit(1 if overall["failed"] else 0)
+
+
+if __name__ == "__main__":
+	main()